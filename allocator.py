@@ -1,306 +1,241 @@
-import cplex
-from cplex.exceptions import CplexError
+from formulation import Formulation
+from backends import new_backend, no_branching_stats, SolverType, SolveStatus, SOLVER_ERRORS
 from model import ObjType
+import heuristics
+import search
+import numpy as np
 import time
 import sys
-from ef_callbacks import MyTooMuchEnvyBranch, MyBranchOnAvgItemValue, MyMIPInfo, MyTooMuchEnvyAndBranchOnAvgItemValue, MyTooMuchEnvyAndBranchSOS1Envy
 
 
 class DoesNotExistException(Exception):
     pass
 
-def __flatten(list2d):
-    """ Flattens a 2d list """
-    return [val for val_list in list2d for val in val_list]
+def _build_envyfree_problem(backend, model, prefs, formulations = None):
+    """Builds either IP (the alternate model adds a max-envy variable E) as
+    one sparse formulation, then loads it into the solver in bulk.  Reuses
+    any matching formulation of model in formulations (a dict), else adds it
+    there; the build time reported includes building the formulation either
+    way, as if it were built alone."""
+
+    if formulations is None:
+        formulations = {}
+
+    key = (prefs.obj_type, prefs.alternate_IP_model, prefs.break_symmetry, prefs.aggregate_items, prefs.lazy_envy)
+    if key not in formulations or prefs.lazy_envy:
+        # (lazy formulations grow as they're solved, so aren't shared)
+        start = time.time()
+        form = Formulation(model, prefs.obj_type, with_envy_var = prefs.alternate_IP_model,
+                           break_symmetry = prefs.break_symmetry, aggregate_items = prefs.aggregate_items,
+                           lazy_envy = prefs.lazy_envy)
+        stop = time.time()
+        formulations[key] = (form, stop-start)
+    form, form_s = formulations[key]
 
-def __build_envyfree_problem(p, model, prefs):
-   
     start = time.time()
-    
-    # Set objective function
-    if prefs.obj_type == ObjType.social_welfare_max:
-        # Objective: max \sum_i \sum_j v_{ij} x_{ij}
-        p.objective.set_sense(p.objective.sense.maximize)
-        obj = __flatten(model.u)
-    elif prefs.obj_type == ObjType.feasibility:
-        # Objective: nothing [just feasibility]
-        obj = [0]*len(__flatten(model.u))
-    else:
-        print "Could not determine objective function type for model."
-        sys.exit(-1)
+    backend.load(form)
+    stop = time.time()
 
-    
-    # One binary variable per item per agent
-    lb = [0]*len(obj)
-    ub = [1]*len(obj)
-    types = "I"*len(obj)
+    return form, form_s + stop-start
 
-    p.variables.add(obj = obj,
-                    lb = lb,
-                    ub = ub,
-                    types = types,
-                    )
 
-    
-    #
-    # Now build the constraint matrix (incrementally)
-    rows = []
-    senses = []
-    rhs = []
-
-    # Each item can be allocated to exactly one agent [SOS1]
-    # For each item j, \sum_i x_{ij} = 1
-    for j in xrange(model.m):
-        rows.append([ [j + i*model.m for i in xrange(model.n)],
-                      [1]*model.n
-                      ])
-        senses.append("E")
-        rhs.append(1)
-
-    # For each allocation A_i to agent i, and each allocation A_j to agent j,
-    # make sure agent i values A_i at least as much as she values A_j
-    for a_i in xrange(model.n):
-
-        # Add A_i's valuation for her allocation 
-        i_indices = [a_i*model.m + j for j in xrange(model.m)]
-        i_values = model.u[a_i]
-
-        for a_j in xrange(model.n):
-
-            # Agent i is not envious of her own allocation
-            if a_i == a_j:
-                continue
-        
-            # Subtract off A_i's value for each of A_j's allocated items
-            j_indices = [a_j*model.m + j for j in xrange(model.m)]
-            j_values = [ -1*val for val in model.u[a_i] ]
 
-            rows.append([ i_indices + j_indices,
-                          i_values + j_values
-                          ])
-            senses.append("G")
-            rhs.append(0)
 
-    p.linear_constraints.add(lin_expr = rows,
-                             rhs = rhs, 
-                             senses = senses,
-                             )
+def _add_start_allocation(backend, model, form, owner):
+    """Suggests giving each item j to agent owner[j] as a MIP start (or the
+    equivalent allocation our symmetry breaking allows).  Under the alternate
+    model the start sets E to its max envy, which no optimum exceeds, so that
+    also becomes a cutoff."""
+    x = form.start_values(model, owner)
+    cols, vals = form.var_idx.ravel().tolist(), x.tolist()
+    if form.break_symmetry:
+        prefix_cols, prefix_vals = form.prefix_values(x)
+        cols += prefix_cols.tolist()
+        vals += prefix_vals.tolist()
+    if form.envy_var is not None:
+        max_envy = heuristics.max_envy(model, owner)
+        cols.append(form.envy_var)
+        vals.append(max_envy)
+        # (a hair above it, so solver tolerances never cut off the start itself)
+        backend.tighten_cutoff(max_envy + 1e-3)
+    backend.add_mip_start(cols, vals)
 
-    stop = time.time()
 
-    return stop-start
+def allocate(model, prefs, start_owner = None, formulations = None):
+    """Solves the instance; start_owner (the agent receiving each item, e.g.
+    from heuristics.find_allocation) is suggested to the solver as a MIP start.
+    Pass the same formulations dict to solve the instance under several prefs
+    without rebuilding its IP."""
+
+    # Our own branch and bound needs no IP at all
+    if prefs.solver == SolverType.native:
+        return search.allocate(model, prefs)
+
+    try:
+        # Record any runtime, build statistics from solving the model
+        stats = no_branching_stats()
 
+        backend = new_backend(prefs)
 
+        #
+        # Build the envy-free IP (either of two models)
+        form, build_s = _build_envyfree_problem(backend, model, prefs, formulations)
+        stats['ModelBuildTime'] = build_s
 
-# Essentially the same IP as __build_envyfree_problem, but with
-# a single additional variable representing the max envy between
-# any two pair of agents
-def __build_envyfree_problem_alt(p, model, prefs):
-   
-    start = time.time()
+        if start_owner is not None:
+            _add_start_allocation(backend, model, form, start_owner)
 
-    # Set objective function
-    # Objective: 0*[binary allocation variables] + 1*[envy variable]
-    p.objective.set_sense(p.objective.sense.minimize)
-    obj = [0]*len(__flatten(model.u)) + [1]
-
-    
-    # One binary variable per item per agent, and one continuous variable
-    # representing the maximum envy between pairs of agents
-    lb = [0]*(len(obj)-1) + [0]
-    ub = [1]*(len(obj)-1) + [cplex.infinity]
-    types = "I"*(len(obj)-1) + "C"
-
-    p.variables.add(obj = obj,
-                    lb = lb,
-                    ub = ub,
-                    types = types,
-                    )
-
-    
-    #
-    # Now build the constraint matrix (incrementally)
-    rows = []
-    senses = []
-    rhs = []
-
-    # Each item can be allocated to exactly one agent [SOS1]
-    # For each item j, \sum_i x_{ij} = 1
-    for j in xrange(model.m):
-        rows.append([ [j + i*model.m for i in xrange(model.n)],
-                      [1]*model.n
-                      ])
-        senses.append("E")
-        rhs.append(1)
-
-    # For each allocation A_i to agent i, and each allocation A_j to agent j,
-    # make sure agent i values A_i at least as much as she values A_j
-    E_idx = len(obj)-1   # E variable is the last column
-    for a_i in xrange(model.n):
-
-        # Add A_i's valuation for her allocation 
-        i_indices = [a_i*model.m + j for j in xrange(model.m)]
-        i_values = model.u[a_i]
-
-        for a_j in xrange(model.n):
-
-            # Agent i is not envious of her own allocation
-            if a_i == a_j:
-                continue
+        _solve_problem(backend, model, prefs, form, stats)
+        if stats['ModelFeasible'] and prefs.verbose:
+            print "Envy-free allocation: {0}".format(form.allocation(backend.get_values(form.var_idx.ravel())).tolist())
+
+        # Keep stats on feasibility, time
+        return stats
         
-            # Subtract off A_i's value for each of A_j's allocated items
-            j_indices = [a_j*model.m + j for j in xrange(model.m)]
-            j_values = [ -1*val for val in model.u[a_i] ]
-
-            rows.append([ i_indices + j_indices + [E_idx],
-                          i_values + j_values + [1.0]
-                          ])
-            
-            # {my val, my bundle} - {my val, your bundle} + E >= 0
-            # For envy-free, sets E = 0 via minimization of objective
-            senses.append("G")
-            rhs.append(0)
-
-    p.linear_constraints.add(lin_expr = rows,
-                             rhs = rhs, 
-                             senses = senses,
-                             )
+    except SOLVER_ERRORS, ex:
+        print ex
+        sys.exit(-1)
 
-    stop = time.time()
-    return stop-start
 
+def _solve_lazily(backend, form, prefs):
+    """Solves form's IP, leaving out its lazy envy rows until needed: CPLEX
+    adds violated ones as lazy constraints from a callback, other solvers
+    re-solve with them added until a solution violates none (sharing one
+    time limit).  Returns (solve time, #nodes, whether the final solution
+    still violates some envy row, i.e. a budget stopped us first)."""
 
+    if backend.supports_lazy_rows:
+        backend.register_lazy_envy(form)
+        solve_s = backend.solve()
+        return solve_s, backend.num_nodes(), False
 
+    solve_s, num_nodes = 0.0, 0
+    while True:
+        solve_s += backend.solve()
+        num_nodes = num_nodes + backend.num_nodes() if backend.num_nodes() >= 0 else -1
+        if not backend.has_solution():
+            return solve_s, num_nodes, False
 
-def allocate(model, prefs):
+        violated = form.violated_envy_rows(backend.get_values(range(len(form.obj))))
+        if len(violated) == 0:
+            return solve_s, num_nodes, False
+        if backend.limit_reached() is not None:
+            return solve_s, num_nodes, True
 
-    try:
-        # Record any runtime, build statistics from solving the model
-        stats = {'MyTooMuchEnvyBranch':0, 'MyBranchOnAvgItemValue':0, 'MyBranchSOS1Envy':0}
+        row_start, triplets = form.add_envy_rows(violated)
+        backend.load(form, len(form.obj), row_start, triplets)
+        if prefs.time_limit is not None:
+            backend.set_limits(max(prefs.time_limit - solve_s, 1e-3), prefs.node_limit)
 
-        # Keep CPLEX quiet, if requested
-        p = cplex.Cplex()
-        p.set_results_stream(None)
-        if prefs.verbose == False:
-            p.parameters.mip.display.set(0)
 
-        # CPLEX global parameters 
-        p.parameters.threads.set(prefs.num_threads)
-        p.parameters.simplex.tolerances.feasibility.set(1e-9)
+def _solve_problem(backend, model, prefs, form, stats):
+    """Registers branching rules and priorities, solves the loaded IP, and
+    records feasibility, how the solve ended (SolveStatus), runtime and tree
+    statistics, and how many envy rows it took in stats"""
 
-        #
-        # Build the envy-free IP (either of two models
-        if prefs.alternate_IP_model:
-            build_s = __build_envyfree_problem_alt(p, model, prefs)
-        else:
-            build_s = __build_envyfree_problem(p, model, prefs)
-        stats['ModelBuildTime'] = build_s
+    backend.register_branching(model, form.var_idx)
 
-        # Register any special branching rules
-        # Must disable CPLEX dynamic search if we have any branching rules
-        if prefs.branch_fathom_too_much_envy or prefs.branch_avg_value or prefs.branch_sos1_envy:
-            p.parameters.mip.strategy.search.set(p.parameters.mip.strategy.search.values.traditional)
-
-        # Can have (TooMuchEnvy fathoming + at most 1 other branching rule)
-        if prefs.branch_fathom_too_much_envy:
-            if prefs.branch_avg_value:
-                my_too_much_envy_and_branch_avg_item = p.register_callback(MyTooMuchEnvyAndBranchOnAvgItemValue)
-                my_too_much_envy_and_branch_avg_item.times_too_much_envy_used = 0
-                my_too_much_envy_and_branch_avg_item.times_branch_on_avg_item_used = 0
-                my_too_much_envy_and_branch_avg_item.model = model
-            elif prefs.branch_sos1_envy:
-                my_too_much_envy_and_branch_sos1_envy = p.register_callback(MyTooMuchEnvyAndBranchSOS1Envy)
-                my_too_much_envy_and_branch_sos1_envy.times_too_much_envy_used = 0
-                my_too_much_envy_and_branch_sos1_envy.times_sos1_envy_used = 0
-                my_too_much_envy_and_branch_sos1_envy.model = model
-            else:      
-                my_too_much_envy = p.register_callback(MyTooMuchEnvyBranch)
-                my_too_much_envy.times_used = 0
-                my_too_much_envy.model = model
-        elif prefs.branch_avg_value:
-            my_branch_avg_item = p.register_callback(MyBranchOnAvgItemValue)
-            my_branch_avg_item.times_used = 0
-            my_branch_avg_item.model = model
-        elif prefs.branch_sos1_envy:
-            my_branch_sos1_envy = p.register_callback(MyBranchSOS1Envy)
-            my_branch_sos1_envy.times_used = 0
-            my_branch_sos1_envy.model = model
-
-        # Keep track of B&C tree information via MIPInfoCallback
-        my_mip_info = p.register_callback(MyMIPInfo)
-        my_mip_info.num_nodes = 0 
-
-        # Possibly prioritize variables based on their average value (value \propto priority)
-        if prefs.prioritize_avg_value:
-            
-            item_positions = sorted(range(model.m), key=lambda k: model.m_avg_vals[k])
-            item_priorities = []
-            for item_idx, position in enumerate(item_positions):
-                # Priority: lowest is 1 (M - last in sorted list), highest is M (M - first=0)
-                priority = model.m - position
-                # Set priorities for each of the binary variables for this item
-                for agent_idx in xrange(model.n):
-                    # order must be a list of triples (variable, priority, direction)
-                    bin_var_idx = (agent_idx * model.m) + item_idx
-                    item_priorities.append( (bin_var_idx, priority, p.order.branch_direction.up) )
-            
-            p.order.set(item_priorities)
-
-
-            
-        #
-        # Solve the IP
-        start = time.time()
-        p.solve()
-        stop = time.time()
-        solve_s = stop - start
-        stats['ModelSolveTime'] = solve_s
-        stats['MIPNodeCount'] = my_mip_info.num_nodes
+    #
+    # Solve the IP
+    unsettled = False
+    if form.lazy_envy:
+        solve_s, num_nodes, unsettled = _solve_lazily(backend, form, prefs)
+    else:
+        solve_s, num_nodes = backend.solve(), backend.num_nodes()
+    stats['ModelSolveTime'] = solve_s
+    stats['MIPNodeCount'] = num_nodes
+    stats['EnvyRows'] = form.num_envy_rows() + (backend.lazy_envy_rows_added() if form.lazy_envy else 0)
 
-        #
-        # Record stats from the run
-        if prefs.branch_fathom_too_much_envy:
-            if prefs.branch_avg_value:
-                stats['MyTooMuchEnvyBranch'] = my_too_much_envy_and_branch_avg_item.times_too_much_envy_used
-                stats['MyBranchOnAvgItemValue'] = my_too_much_envy_and_branch_avg_item.times_branch_on_avg_item_used
-            elif prefs.branch_sos1_envy:
-                stats['MyTooMuchEnvyBranch'] = my_too_much_envy_and_branch_sos1_envy.times_too_much_envy_used
-                stats['MyBranchSOS1Envy'] = my_too_much_envy_and_branch_sos1_envy.times_sos1_envy_used
+    #
+    # Record stats from the run
+    stats.update(backend.branching_stats())
+
+    # Was there a solution? (not guaranteed for envy-free)
+    feasible = True
+
+    if not backend.has_solution() or unsettled:
+        feasible = False
+        stats['MIPObjVal'] = 0
+    else:
+        # If we're using the second IP, E-F exists if objective <= 0
+        # check if the obj is >0 (plus CPLEX's default constraint violation error)
+        if prefs.alternate_IP_model and backend.objective_value() > 1e-6:
+            feasible = False
+        stats['MIPObjVal'] = backend.objective_value()
+        
+        if feasible == True:
+            if prefs.verbose:
+                print "Objective value: {0:2f}".format(backend.objective_value())
+                
+    stats['ModelFeasible'] = feasible
+
+    # An allocation found before the budget ran out still proves existence,
+    # but nothing else is settled if the solver was stopped
+    limit = backend.limit_reached()
+    if limit is not None and not (feasible and prefs.obj_type == ObjType.feasibility):
+        stats['SolveStatus'] = limit
+    else:
+        stats['SolveStatus'] = SolveStatus.feasible if feasible else SolveStatus.infeasible
+
+
+class IncrementalAllocator:
+    """Solves a nested item sweep on one solver problem.  Each model passed to
+    allocate() must extend the previous one with new items (same agents, same
+    utilities for the old items); the new item columns are added and the
+    existing envy rows updated in place, and the previous allocation, with
+    each new item given to the agent who values it most, is handed to the
+    solver as a MIP start to repair (alongside any start_owner passed in)."""
+
+    def __init__(self, prefs):
+        self.prefs = prefs
+        self.backend = None
+        self.form = None
+        self.last_owner = None   # agent receiving each item in the last solve
+
+    def allocate(self, model, start_owner = None):
+
+        try:
+            # Record any runtime, build statistics from solving the model
+            stats = no_branching_stats()
+
+            # Build the IP from scratch the first time (or if it can't grow,
+            # see Formulation.can_extend), then only add items
+            start = time.time()
+            if self.backend is None or not self.form.can_extend(model):
+                self.backend = new_backend(self.prefs)
+                self.form = Formulation(model, self.prefs.obj_type, with_envy_var = self.prefs.alternate_IP_model,
+                                        break_symmetry = self.prefs.break_symmetry,
+                                        aggregate_items = self.prefs.aggregate_items)
+                self.backend.load(self.form)
+            else:
+                col_start, row_start, triplets = self.form.extend(model)
+                self.backend.load(self.form, col_start, row_start, triplets)
+            self.__add_warm_start(model)
+            if start_owner is not None:
+                _add_start_allocation(self.backend, model, self.form, start_owner)
+            stop = time.time()
+            stats['ModelBuildTime'] = stop-start
+
+            _solve_problem(self.backend, model, self.prefs, self.form, stats)
+
+            # Remember this allocation to warm-start the next, larger instance
+            if self.backend.has_solution():
+                self.last_owner = self.form.allocation(self.backend.get_values(self.form.var_idx.ravel().tolist()))
             else:
-                stats['MyTooMuchEnvyBranch'] = my_too_much_envy.times_used
-        elif prefs.branch_avg_value:
-            stats['MyBranchOnAvgItemValue'] = my_branch_avg_item.times_used
-        elif prefs.branch_sos1_envy:
-            stats['MyBranchSOS1Envy'] = my_branch_sos1_envy.times_used
+                self.last_owner = None
 
+            # Keep stats on feasibility, time
+            return stats
 
-        # Was there a solution? (not guaranteed for envy-free)
-        feasible = True
-        sol = p.solution
+        except SOLVER_ERRORS, ex:
+            print ex
+            sys.exit(-1)
 
-        if sol.get_status() == 3 or sol.get_status() == 103:
-            feasible = False
-            stats['MIPObjVal'] = 0
-        else:
-            # If we're using the second IP, E-F exists if objective <= 0
-            # check if the obj is >0 (plus CPLEX's default constraint violation error)
-            if prefs.alternate_IP_model and sol.get_objective_value() > 1e-6:
-                feasible = False
-            stats['MIPObjVal'] = sol.get_objective_value()
-            
-            if feasible == True:
-                if prefs.verbose:
-                    print "{0:d}:  {1}   ||   Objective value: {2:2f}".format(
-                        sol.get_status(), 
-                        sol.status[sol.get_status()], 
-                        sol.get_objective_value())
-                    
-        stats['ModelFeasible'] = feasible
+    def __add_warm_start(self, model):
 
-        # Keep stats on feasibility, time
-        return stats
-        
-    except CplexError, ex:
-        print ex
-        sys.exit(-1)
+        if self.last_owner is None:
+            return
 
+        # Keep the old allocation; give each new item to whoever wants it most
+        owner = np.concatenate((self.last_owner, np.argmax(model.u[:,len(self.last_owner):], axis=0)))
+        _add_start_allocation(self.backend, model, self.form, owner)
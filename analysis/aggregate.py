@@ -0,0 +1,127 @@
+import numpy as np
+
+from data_utils import Status
+
+
+def grouped_mean(group, values, num_groups):
+    """Mean of values in each group (nan where empty)"""
+    counts = np.bincount(group, minlength=num_groups)
+    sums = np.bincount(group, weights=values, minlength=num_groups)
+    with np.errstate(invalid='ignore'):
+        return sums / counts
+
+
+def grouped_median(group, values, num_groups):
+    """Median of values in each group (nan where empty), from one sort of all
+    of them by (group, value)"""
+    values = values[np.lexsort((values, group))]
+    counts = np.bincount(group, minlength=num_groups)
+    starts = np.cumsum(counts) - counts
+    medians = np.full(num_groups, np.nan)
+    some = counts > 0
+    lo, hi = starts[some] + (counts[some] - 1) // 2, starts[some] + counts[some] // 2
+    medians[some] = (values[lo] + values[hi]) / 2.
+    return medians
+
+
+class GroupStats:
+    """Statistics of each group of runs that agree on key_cols, for data (row
+    matrix from IOUtil.load or load_old_data, indexed by layout, Col or
+    OldCol).  The rows are grouped by one sort, and every statistic is then
+    taken for all groups at once, instead of filtering the data per group.
+
+    Runs stopped by their time or node budget count as timeouts, not in the
+    other statistics; with a timeout_penalty_s, each timeout adds a solve time
+    of that many seconds to solve_s.  Older layouts have no status column, so
+    records_timeouts is False: their timed-out runs left no rows, and
+    solve_s_series infers them from the rows missing.  Solve times are
+    medians, or means if do_average."""
+
+    def __init__(self, data, key_cols, layout, timeout_penalty_s = None, do_average = False):
+        self.timeout_penalty_s = timeout_penalty_s
+        self.do_average = do_average
+
+        # Sorted distinct keys, and each row's group (its key's position)
+        self.keys, group = np.unique(data[:,key_cols], axis=0, return_inverse=True)
+        self._index = dict((tuple(key), g) for g, key in enumerate(self.keys.tolist()))
+        num_groups = len(self.keys)
+
+        self.records_timeouts = hasattr(layout, 'status') and np.any(data[:,layout.status] != Status.unrecorded)
+        if self.records_timeouts:
+            settled = np.in1d(data[:,layout.status], (Status.feasible, Status.infeasible))
+        else:
+            settled = np.ones(len(data), dtype=bool)
+        self.timeouts = np.bincount(group[~settled], minlength=num_groups)
+
+        group = group[settled]
+        feasible = data[settled,layout.feasible] == 1
+        solve_s = data[settled,layout.solve_s]
+
+        # Settled runs, the fraction feasible, and solve times split by outcome
+        self.count = np.bincount(group, minlength=num_groups)
+        self.feas_frac = grouped_mean(group, feasible.astype(float), num_groups)
+        self.solve_s_feas = self._runtime(group[feasible], solve_s[feasible], num_groups)
+        self.solve_s_infeas = self._runtime(group[~feasible], solve_s[~feasible], num_groups)
+
+        # Every run's solve time, timeouts at the penalty
+        if timeout_penalty_s is not None:
+            penalized = np.repeat(np.arange(num_groups), self.timeouts)
+            self.solve_s = self._runtime(np.concatenate((group, penalized)),
+                                         np.concatenate((solve_s, np.full(len(penalized), float(timeout_penalty_s)))),
+                                         num_groups)
+        else:
+            self.solve_s = self._runtime(group, solve_s, num_groups)
+        self.solve_s[self.count == 0] = np.nan   # (no settled runs to go by)
+
+        # Each group's settled solve times, sorted, for solve_s_with_timeouts
+        order = np.lexsort((solve_s, group))
+        self._sorted_solve_s = solve_s[order]
+        self._starts = np.cumsum(self.count) - self.count
+
+    def _runtime(self, group, values, num_groups):
+        return (grouped_mean if self.do_average else grouped_median)(group, values, num_groups)
+
+    def find(self, *key):
+        """The group with this key (values for key_cols, in order), or None"""
+        return self._index.get(tuple(float(k) for k in key))
+
+    def solve_s_with_timeouts(self, g, timeouts):
+        """Group g's solve time, counting timeouts (not its own) at the penalty;
+        for layouts that don't record timed-out runs, only their absence"""
+        start = self._starts[g]
+        solve_s = self._sorted_solve_s[start:start+self.count[g]]
+        if self.timeout_penalty_s is not None:
+            solve_s = np.append(solve_s, [self.timeout_penalty_s]*timeouts)
+        return np.average(solve_s) if self.do_average else np.median(solve_s)
+
+    def solve_s_series(self, key, num_items_list):
+        """(group, settled runs, timeouts, solve time or None) at each #items in
+        num_items_list, for the groups keyed by key then #items (the last key
+        column).  Where timeouts went unrecorded, each point's are the runs it
+        lost since the previous point (none at the first with any runs)."""
+        series = []
+        old_data_ct = -1
+        for num_items in num_items_list:
+            g = self.find(*(list(key) + [num_items]))
+            data_ct = self.count[g] if g is not None else 0
+            if self.records_timeouts:
+                timeout_ct = self.timeouts[g] if g is not None else 0
+                solve_s = value_or_none(self.solve_s, g)
+            else:
+                # If we're on the first data point, assume no timeouts
+                if old_data_ct <= 0:
+                    timeout_ct = 0
+                else:
+                    timeout_ct = max(old_data_ct - data_ct, 0)
+                old_data_ct = data_ct
+                solve_s = self.solve_s_with_timeouts(g, timeout_ct) if data_ct > 0 else None
+            series.append((g, data_ct, timeout_ct, solve_s))
+        return series
+
+
+def value_or_none(stat, g):
+    """stat for group g as a plot point: None if there's no such group or it
+    had no runs to take stat over"""
+    if g is None or np.isnan(stat[g]):
+        return None
+    return stat[g]
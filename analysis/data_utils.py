@@ -1,4 +1,10 @@
 import numpy as np
+import os
+import sys
+
+# npz_io lives with the driver, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from npz_io import save_npz
 
 # Maps column indices to the data they hold
 class Col:
@@ -18,7 +24,15 @@ class Col:
      mip_node_count,
      build_s, 
      solve_s,
-     obj_val) = range(20)
+     obj_val,
+     screen_test,
+     screen_s,
+     heuristic_solved,
+     heuristic_s,
+     status,
+     envy_rows,
+     config,
+     task_id) = range(28)
 
 class OldCol:
     (seed, 
@@ -39,9 +53,42 @@ class OldCol:
      obj_val) = range(19)
 
 
+# How each solve ended (backends.SolveStatus); unrecorded for layouts
+# without a status column, whose timed-out runs just left no row
+class Status:
+    feasible, infeasible, timeout, node_limit = range(4)
+    unrecorded = -1
+
+
+# Version of the columnar result store's layout (IOUtil.save_columns); any
+# change to the columns, their names or their types must bump it
+SCHEMA_VERSION = 2
+
+def column_names(layout):
+    """Names of a Col-like class's columns, in row order"""
+    return [name for index, name in sorted((v, k) for k, v in vars(layout).items() if isinstance(v, int))]
+
+# Types of the stored columns: flags, integer ids and counts, and floats
+BOOL_COLUMNS = set(['alternate_IP_model_on', 'fathom_too_much_envy_on', 'branch_avg_value_on', 'branch_sos1_envy_on',
+                    'prioritize_avg_value_on', 'feasible', 'heuristic_solved'])
+FLOAT_COLUMNS = set(['build_s', 'solve_s', 'obj_val', 'screen_s', 'heuristic_s'])
+
+def column_type(name):
+    return np.bool_ if name in BOOL_COLUMNS else (np.float64 if name in FLOAT_COLUMNS else np.int64)
+
+# The columns each row layout driver.py has written holds, by row width: the
+# old layout (OldCol), the baseline one and the current one (Col)
+LAYOUTS = {19: column_names(OldCol),
+           20: column_names(Col)[:20],
+           28: column_names(Col),
+           }
+
+
 class IOUtil:
     obj_type_map = {0: "Existence", 1: "Social Welfare Max"}
     dist_type_map = {1: "U[0,1]", 4: "Correlated"}
+    screen_test_map = {0: "None", 1: "Too Few Items", 2: "Contested Top Item", 3: "Proportionality"}
+    status_map = {-1: "Unrecorded", 0: "Feasible", 1: "Infeasible", 2: "Timeout", 3: "Node Limit"}
     
     # Converts "True" or "False" to 1 or 0 integral, respectively
     @staticmethod
@@ -52,39 +99,125 @@ class IOUtil:
         else:
             return 0.  # If we can't understand it, return false
 
+    @staticmethod
+    def parse_csv(filename_data, chunk_bytes = 1 << 26):
+        """Reads driver.py output of any layout in LAYOUTS as typed columns
+        (a dict from Col name to array), filling in columns older layouts
+        lack.  Parses whole chunks of rows at once in C, not cell by cell."""
+
+        chunks, tail = [], ""
+        with open(filename_data, 'rb') as f:
+            for block in iter(lambda: f.read(chunk_bytes), ""):
+                text = tail + block
+                cut = text.rfind("\n") + 1
+                if cut > 0:
+                    chunks.append(IOUtil._parse_rows(text[:cut]))
+                tail = text[cut:]
+        if tail.strip():
+            chunks.append(IOUtil._parse_rows(tail + "\n"))
+
+        widths = set(chunk.shape[1] for chunk in chunks)
+        if len(widths) > 1:
+            raise ValueError("{0} mixes rows of {1} columns".format(filename_data, sorted(widths)))
+        width = widths.pop() if widths else len(LAYOUTS[max(LAYOUTS)])
+        if width not in LAYOUTS:
+            raise ValueError("{0} has rows of {1} columns, but only the old, baseline and current layouts ({2} columns) "
+                             "can be read".format(filename_data, width, ", ".join(str(w) for w in sorted(LAYOUTS))))
+        rows = np.concatenate(chunks) if chunks else np.zeros((0, width))
+
+        layout = LAYOUTS[width]
+        columns = dict((name, rows[:,k].astype(column_type(name))) for k, name in enumerate(layout))
+
+        # What older runs didn't record: they ran no screening or heuristics,
+        # plain models, one configuration each, with no manifest or budget,
+        # and how (or whether) each run ended
+        num_rows = len(rows)
+        for name in column_names(Col):
+            if name not in columns:
+                columns[name] = np.zeros(num_rows, dtype=column_type(name))
+        if 'task_id' not in layout:
+            columns['task_id'][:] = -1
+        if 'status' not in layout:
+            columns['status'][:] = Status.unrecorded
+        return columns
+
+    @staticmethod
+    def _parse_rows(text):
+        # Whole lines of csv, with booleans as "True"/"False", as a 2D array
+        width = text[:text.index("\n")].count(",") + 1
+        num_rows = text.count("\n")
+        text = text.replace("True", "1").replace("False", "0").replace("\r", "").replace("\n", ",")
+        values = np.fromstring(text[:-1], sep=",")
+        if len(values) != num_rows * width:
+            raise ValueError("couldn't parse {0} rows of {1} numeric columns".format(num_rows, width))
+        return values.reshape(num_rows, width)
+
+    @staticmethod
+    def save_columns(filename, columns):
+        """Writes typed columns (from parse_csv) as a columnar store: an .npz
+        file with one array per column, plus the schema version.  Stored
+        uncompressed, so loading is just reading the arrays back."""
+        arrays = dict(columns)
+        arrays['schema_version'] = np.array(SCHEMA_VERSION)
+        save_npz(filename, arrays)
+
+    @staticmethod
+    def store_csv(filename_data):
+        """Parses driver.py csv output and stores its columns next to it
+        (FILE.npz), where load_columns picks them up until the csv changes"""
+        IOUtil.save_columns(filename_data + '.npz', IOUtil.parse_csv(filename_data))
+
+    @staticmethod
+    def load_columns(filename_data):
+        """Loads results as typed columns (a dict from Col name to array), from
+        a columnar store (.npz) or from driver.py csv output.  A csv is read
+        from its store (see store_csv) if that is current, else parsed; loading
+        never writes anything."""
+
+        if not filename_data.endswith('.npz'):
+            store_filename = filename_data + '.npz'
+            if not IOUtil._store_is_current(store_filename, filename_data):
+                return IOUtil.parse_csv(filename_data)
+            filename_data = store_filename
+
+        with np.load(filename_data) as f:
+            version = int(f['schema_version']) if 'schema_version' in f else None
+            if version != SCHEMA_VERSION:
+                raise ValueError("{0} has schema version {1}, not {2}".format(filename_data, version, SCHEMA_VERSION))
+            return dict((name, f[name]) for name in column_names(Col))
+
+    @staticmethod
+    def _store_is_current(store_filename, filename_data):
+        # Stored since the csv last changed, by this version of the schema?
+        if not os.path.exists(store_filename) or os.path.getmtime(store_filename) < os.path.getmtime(filename_data):
+            return False
+        with np.load(store_filename) as f:
+            return 'schema_version' in f and int(f['schema_version']) == SCHEMA_VERSION
+
+    @staticmethod
+    def as_rows(columns, layout = Col):
+        """The columns as one row per run, indexed by layout (Col or OldCol)"""
+        return np.column_stack([columns[name] for name in column_names(layout)]).astype(np.float64)
+
     @staticmethod
     def load(filename_data):
         # Load all the data at once
         print 'Loading data from ' + filename_data
-        data = np.genfromtxt(filename_data, 
-                             delimiter=',', 
-                             skiprows=0,
-                             converters={
-                Col.alternate_IP_model_on: IOUtil.get_boolean_from_string,
-                Col.feasible: IOUtil.get_boolean_from_string,
-                Col.fathom_too_much_envy_on: IOUtil.get_boolean_from_string,
-                Col.branch_avg_value_on: IOUtil.get_boolean_from_string,
-                Col.branch_sos1_envy_on: IOUtil.get_boolean_from_string,
-                Col.prioritize_avg_value_on: IOUtil.get_boolean_from_string,
-                                         }, 
-                             )
+        data = IOUtil.as_rows(IOUtil.load_columns(filename_data))
         print 'Loaded ' + str(len(data)) + ' rows of data.'
         return data
 
     @staticmethod
     def load_old_data(filename_data):
-        # Load all the data at once
+        # Load all the data at once, indexed by OldCol
         print 'Loading data from ' + filename_data
-        data = np.genfromtxt(filename_data, 
-                             delimiter=',', 
-                             skiprows=0,
-                             converters={
-                Col.feasible: IOUtil.get_boolean_from_string,
-                Col.fathom_too_much_envy_on: IOUtil.get_boolean_from_string,
-                Col.branch_avg_value_on: IOUtil.get_boolean_from_string,
-                Col.branch_sos1_envy_on: IOUtil.get_boolean_from_string,
-                Col.prioritize_avg_value_on: IOUtil.get_boolean_from_string,
-                                         }, 
-                             )
+        data = IOUtil.as_rows(IOUtil.load_columns(filename_data), OldCol)
         print 'Loaded ' + str(len(data)) + ' rows of data.'
         return data
+
+
+if __name__ == '__main__':
+    # Stores each csv given as a columnar store, for faster loading
+    for filename_data in sys.argv[1:]:
+        print 'Storing ' + filename_data + ' as ' + filename_data + '.npz'
+        IOUtil.store_csv(filename_data)
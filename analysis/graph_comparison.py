@@ -7,6 +7,7 @@ from matplotlib.font_manager import FontProperties
 import matplotlib.patches as patches   # For the proxy twin-axis legend entry
 
 from data_utils import Col, IOUtil
+import aggregate
 
 # Raw .csv file containing data
 #filename_data = "../data/comparison_models_12hr.csv" # use this for n=10 graphs
@@ -57,6 +58,10 @@ TICKFONT={'fontsize':16}
 # Load data
 data = IOUtil.load(filename_data)
 
+# Then take the stats of every {objective, distribution, #agents, tweaks, #items} at once
+stats = aggregate.GroupStats(data, [Col.obj_type, Col.dist_type, Col.num_agents] + tweak_map + [Col.num_items], Col,
+                             timeout_penalty_s if timeout_penalty_on else None, do_average)
+
 # Grab proper iteration data
 num_agents_list = np.unique(data[:,Col.num_agents])
 #num_items_list = np.unique(data[:,Col.num_items])
@@ -82,12 +87,6 @@ for obj_type in obj_type_list:
 
             print "Obj={0}, Dist={1}, N={2} ...".format(IOUtil.obj_type_map[int(obj_type)], IOUtil.dist_type_map[int(dist_type)], int(num_agents)) 
 
-            data_num_agents = [row for row in data 
-                               if row[Col.num_agents] == num_agents 
-                               and row[Col.dist_type] == dist_type
-                               and row[Col.obj_type] == obj_type
-                               ]
-            
             # Plot all parameterizations on the same canvas
             fig = plt.figure()
             ax = fig.add_subplot(111)
@@ -99,14 +98,6 @@ for obj_type in obj_type_list:
                 if not params['on']:
                     continue
 
-                # Only get correct branch+prioritization data
-                specific = [row for row in data_num_agents
-                            if row[tweak_map[0]] == params['x'][0]
-                            and row[tweak_map[1]] == params['x'][1]
-                            and row[tweak_map[2]] == params['x'][2]
-                            and row[tweak_map[3]] == params['x'][3]
-                            ]
-
                 # Want to plot (a) %feasible and (b) runtime to prove opt/infeas
                 y_solve_s = []
                 y_feas = []
@@ -114,61 +105,25 @@ for obj_type in obj_type_list:
                 y_solve_s_infeas = []
 
                 any_data = False
-                data_pt_count = 0
-                old_data_ct = -1
-                for num_items in num_items_list:
-                    
-                    # Grab just the data for this {number of agents, number of items}
-                    data_num_items = [row for row in specific 
-                                      if row[Col.num_items] == num_items]
-                    data_solve_s = np.array([row[Col.solve_s] for row in data_num_items])
-                    data_feas = np.array([row[Col.feasible] for row in data_num_items])
-                    data_solve_s_feas = np.array([row[Col.solve_s] for row in data_num_items
-                                                  if int(row[Col.feasible]) == 1])
-                    data_solve_s_infeas = np.array([row[Col.solve_s] for row in data_num_items
-                                                    if int(row[Col.feasible]) == 0])
-
-                    # If we're on the first data point, assume no timeouts and start recording old data points
-                    if old_data_ct <= 0:
-                        timeout_ct = 0
-                    else:
-                        timeout_ct = old_data_ct - len(data_solve_s)
-                    old_data_ct = len(data_solve_s)
+                series = stats.solve_s_series([obj_type, dist_type, num_agents] + params['x'], num_items_list)
+                for num_items, (g, data_ct, timeout_ct, solve_s) in zip(num_items_list, series):
+
+                    # Just the stats for this branch+prioritization and
+                    # {number of agents, number of items}; runs stopped by their
+                    # time or node budget count only as timeouts, and older
+                    # files (no status column) lost those runs' rows, so their
+                    # timeouts are the rows missing since the last point
 
                     if verbose and num_agents > 6:
-                        print "N={0} M={1} Data={2} Dropped={3}".format(int(num_agents), int(num_items), len(data_solve_s), timeout_ct)
-                        
-                    if len(data_solve_s) > 0:
+                        print "N={0} M={1} Data={2} Dropped={3}".format(int(num_agents), int(num_items), data_ct, timeout_ct)
+
+                    if data_ct > 0:
                         any_data = True
+                    y_solve_s.append( solve_s )
+                    y_feas.append( aggregate.value_or_none(stats.feas_frac, g) )
+                    y_solve_s_feas.append( aggregate.value_or_none(stats.solve_s_feas, g) )
+                    y_solve_s_infeas.append( aggregate.value_or_none(stats.solve_s_infeas, g) )
 
-                        if timeout_penalty_on:
-                            data_solve_s = np.append( data_solve_s, [timeout_penalty_s]*timeout_ct )
-
-                        if do_average:
-                            y_solve_s.append( np.average(data_solve_s) )
-                        else:
-                            y_solve_s.append( np.median(data_solve_s) )
-
-                        y_feas.append( np.average(data_feas) )
-
-                    else:
-                        y_solve_s.append( None )
-                        y_feas.append( None )
-
-                    if len(data_solve_s_feas) == 0:
-                        y_solve_s_feas.append( None )
-                    else:
-                        if do_average:
-                            y_solve_s_feas.append( np.average(data_solve_s_feas) )
-                        else:
-                            y_solve_s_feas.append( np.median(data_solve_s_feas) )
-                    if len(data_solve_s_infeas) == 0:
-                        y_solve_s_infeas.append( None )
-                    else:
-                        if do_average:
-                            y_solve_s_infeas.append( np.average(data_solve_s_infeas) )
-                        else:
-                            y_solve_s_infeas.append( np.median(data_solve_s_infeas) )
                 # If we didn't read any valid data points (solve times), skip plotting
                 if not any_data:
                     continue
@@ -6,6 +6,7 @@ import numpy as np
 from matplotlib.font_manager import FontProperties
 import matplotlib.patches as patches   # For the proxy twin-axis legend entry
 from data_utils import IOUtil
+import aggregate
 
 # Raw .csv file containing data
 #filename_data = "../data/comparison_models_12hr.csv"
@@ -41,7 +42,11 @@ do_average = False
 print "Plotting", ("average" if do_average else "median"), "runtimes."
 
 # Load all the data at once (OLDER data)
-data = IOUtil.load_old_data(filename_data)
+data = IOUtil.load_old_data(filename_data) if using_old_data else IOUtil.load(filename_data)
+
+# Then take the stats of every {objective, distribution, #agents, #items} at once
+stats = aggregate.GroupStats(data, [Col.obj_type, Col.dist_type, Col.num_agents, Col.num_items], Col,
+                             timeout_penalty_s if timeout_penalty_on else None, do_average)
 
 # Grab proper iteration data
 num_agents_list = np.unique(data[:,Col.num_agents])
@@ -68,12 +73,6 @@ for obj_type in obj_type_list:
 
             print "Obj={0}, Dist={1}, N={2} ...".format(IOUtil.obj_type_map[int(obj_type)], IOUtil.dist_type_map[int(dist_type)], int(num_agents)) 
 
-            data_num_agents = [row for row in data 
-                               if row[Col.num_agents] == num_agents 
-                               and row[Col.dist_type] == dist_type
-                               and row[Col.obj_type] == obj_type
-                               ]
-
             # Want to plot (a) %feasible and (b) runtime to prove opt/infeas
             y_feas = []
             y_solve_s = []
@@ -81,59 +80,22 @@ for obj_type in obj_type_list:
             y_solve_s_infeas = []
 
             any_data = False
-            old_data_ct = -1
-            for num_items in num_items_list:
-
-                # Grab just the data for this {number of agents, number of items}
-                data_num_items = [row for row in data_num_agents 
-                                  if row[Col.num_items] == num_items]
-
-                data_feas = np.array([row[Col.feasible] for row in data_num_items])
-                data_solve_s = np.array([row[Col.solve_s] for row in data_num_items])
+            series = stats.solve_s_series((obj_type, dist_type, num_agents), num_items_list)
+            for num_items, (g, data_ct, timeout_ct, solve_s) in zip(num_items_list, series):
 
-                # If we're on the first data point, assume no timeouts and start recording old data points
-                if old_data_ct <= 0:
-                    timeout_ct = 0
-                else:
-                    timeout_ct = old_data_ct - len(data_solve_s)
-                old_data_ct = len(data_solve_s)
-
-                if len(data_solve_s) > 0:
+                # Just the stats for this {number of agents, number of items};
+                # runs stopped by their budget count only as timeouts, and
+                # older runs' timeouts are the rows lost since the last point
+                if data_ct > 0:
                     any_data = True
 
-                    if timeout_penalty_on:
-                        data_solve_s = np.append( data_solve_s, [timeout_penalty_s]*timeout_ct )
-
-                feas_frac = np.average(data_feas)
-                if feas_frac >= 0.99:
+                feas_frac = aggregate.value_or_none(stats.feas_frac, g)
+                if feas_frac is not None and feas_frac >= 0.99:
                     print "W.h.p. exists @ n={0}, m={1}".format(int(num_agents), int(num_items))
-
                 y_feas.append( feas_frac )
-                
-                if do_average:
-                    y_solve_s.append( np.average(data_solve_s) )
-                else:
-                    y_solve_s.append( np.median(data_solve_s) )
-
-                data_solve_s_feas = np.array([row[Col.solve_s] for row in data_num_items
-                                              if int(row[Col.feasible]) == 1])
-                data_solve_s_infeas = np.array([row[Col.solve_s] for row in data_num_items
-                                                if int(row[Col.feasible]) == 0])        
-                if len(data_solve_s_feas) == 0:
-                    y_solve_s_feas.append( None )
-                else:
-                    if do_average:
-                        y_solve_s_feas.append( np.average(data_solve_s_feas) )
-                    else:
-                        y_solve_s_feas.append( np.median(data_solve_s_feas) )
-
-                if len(data_solve_s_infeas) == 0:
-                    y_solve_s_infeas.append( None )
-                else:
-                    if do_average:
-                        y_solve_s_infeas.append( np.average(data_solve_s_infeas) )
-                    else:
-                        y_solve_s_infeas.append( np.median(data_solve_s_infeas) )
+                y_solve_s.append( solve_s )
+                y_solve_s_feas.append( aggregate.value_or_none(stats.solve_s_feas, g) )
+                y_solve_s_infeas.append( aggregate.value_or_none(stats.solve_s_infeas, g) )
 
             # If we didn't read any valid data points (solve times), skip plotting
             if not any_data:
@@ -0,0 +1,420 @@
+import collections
+import numpy as np
+import time
+
+# Solvers are optional: CPLEX needs a license, CBC ships with PuLP
+try:
+    import cplex
+    from cplex.exceptions import CplexError
+    from ef_callbacks import MyTooMuchEnvyBranch, MyBranchOnAvgItemValue, MyBranchSOS1Envy, MyMIPInfo, MyTooMuchEnvyAndBranchOnAvgItemValue, MyTooMuchEnvyAndBranchSOS1Envy, MyLazyEnvy
+except ImportError:
+    cplex = None
+
+try:
+    import pulp
+    from pulp.solvers import PulpSolverError
+except ImportError:
+    pulp = None
+
+# Exceptions any of the available solvers can raise
+SOLVER_ERRORS = tuple(([CplexError] if cplex is not None else []) +
+                      ([PulpSolverError] if pulp is not None else []))
+
+
+def no_branching_stats():
+    """Times each of our branching rules fired, all zero: the stats of a
+    solve that used none of them (see SolverBackend.branching_stats)"""
+    return {'MyTooMuchEnvyBranch':0, 'MyBranchOnAvgItemValue':0, 'MyBranchSOS1Envy':0}
+
+
+class SolverType:
+    cplex, cbc, native = range(3)
+
+
+class SolveStatus:
+    """How a solve ended: proved either way, or stopped by its budget"""
+    feasible, infeasible, timeout, node_limit = range(4)
+
+
+class SolverBackend:
+    """What allocator needs from a MIP solver: load a Formulation (all of it,
+    or just the columns, rows and nonzeros added by Formulation.extend),
+    register our branching rules and priorities where the solver supports
+    them, take a MIP start, solve, and report on the solution."""
+
+    # Can we hook our own branching rules and priorities into the solver?
+    supports_branching = False
+
+    # Can the solver add lazy envy rows itself, mid-solve?
+    supports_lazy_rows = False
+
+    def __init__(self, prefs):
+        self.prefs = prefs
+
+    def load(self, form, col_start = 0, row_start = 0, triplets = None):
+        raise NotImplementedError
+
+    def set_threads(self, num_threads):
+        raise NotImplementedError
+
+    def set_limits(self, time_limit, node_limit):
+        """Stops each solve after time_limit seconds or node_limit nodes
+        (either may be None, for no limit)"""
+        raise NotImplementedError
+
+    def limit_reached(self):
+        """SolveStatus.timeout or node_limit if the last solve was stopped
+        by its budget, else None"""
+        raise NotImplementedError
+
+    def register_branching(self, model, var_idx):
+        """Registers any branching rules and priorities requested in prefs"""
+        if self.prefs.branch_fathom_too_much_envy or self.prefs.branch_avg_value \
+                or self.prefs.branch_sos1_envy or self.prefs.prioritize_avg_value:
+            raise NotImplementedError("Solver does not support custom branching rules or priorities.")
+
+    def branching_stats(self):
+        """Times each registered branching rule fired during the last solve"""
+        return {}
+
+    def register_lazy_envy(self, form):
+        """Has the next solve add form's lazy envy rows as they're violated"""
+        raise NotImplementedError("Solver does not support lazy constraints.")
+
+    def lazy_envy_rows_added(self):
+        """Distinct lazy envy rows the last solve added itself"""
+        return 0
+
+    def add_mip_start(self, cols, vals):
+        """Suggests the (partial) solution x[cols] = vals for the next solve;
+        ignored by default"""
+        pass
+
+    def tighten_cutoff(self, cutoff):
+        """Has the next solve (minimizing) discard solutions worth more than
+        cutoff; repeated calls keep the lowest.  Ignored by default."""
+        pass
+
+    def solve(self):
+        """Solves the loaded IP; returns the solve time in seconds"""
+        raise NotImplementedError
+
+    def has_solution(self):
+        raise NotImplementedError
+
+    def objective_value(self):
+        raise NotImplementedError
+
+    def get_values(self, cols):
+        raise NotImplementedError
+
+    def num_nodes(self):
+        """Size of the last branch-and-bound tree, or -1 if not reported"""
+        return -1
+
+
+class CplexBackend(SolverBackend):
+    """IBM CPLEX, with our branching callbacks and priorities"""
+
+    supports_branching = True
+    supports_lazy_rows = True
+
+    def __init__(self, prefs):
+        SolverBackend.__init__(self, prefs)
+
+        # Keep CPLEX quiet, if requested
+        self.p = cplex.Cplex()
+        self.p.set_results_stream(None)
+        if prefs.verbose == False:
+            self.p.parameters.mip.display.set(0)
+
+        # CPLEX global parameters
+        self.p.parameters.simplex.tolerances.feasibility.set(1e-9)
+
+        self.branch_callback = None
+        self.lazy_callback = None
+        self.cutoff = None
+
+    def load(self, form, col_start = 0, row_start = 0, triplets = None):
+        p = self.p
+
+        # Set objective function
+        if form.maximize:
+            p.objective.set_sense(p.objective.sense.maximize)
+        else:
+            p.objective.set_sense(p.objective.sense.minimize)
+
+        # One column per variable; CPLEX has its own infinity
+        ub = np.where(np.isinf(form.ub[col_start:]), cplex.infinity, form.ub[col_start:])
+        p.variables.add(obj = form.obj[col_start:].tolist(),
+                        lb = form.lb[col_start:].tolist(),
+                        ub = ub.tolist(),
+                        types = form.types[col_start:],
+                        )
+
+        # Add the (empty) rows, then fill in the constraint matrix all at once
+        p.linear_constraints.add(rhs = form.rhs[row_start:].tolist(),
+                                 senses = form.senses[row_start:],
+                                 )
+        rows, cols, vals = triplets if triplets is not None else (form.rows, form.cols, form.vals)
+        p.linear_constraints.set_coefficients(zip(rows.tolist(), cols.tolist(), vals.tolist()))
+
+        # Our SOS1 envy branching splits the items' SOS1 sets
+        if self.prefs.branch_sos1_envy:
+            for cols, weights in form.item_sos1_sets(col_start):
+                p.SOS.add(type = p.SOS.type.SOS1,
+                          SOS = cplex.SparsePair(ind = cols.tolist(), val = weights.tolist()))
+
+    def set_threads(self, num_threads):
+        self.p.parameters.threads.set(num_threads)
+
+    def set_limits(self, time_limit, node_limit):
+        if time_limit is not None:
+            self.p.parameters.timelimit.set(time_limit)
+        if node_limit is not None:
+            self.p.parameters.mip.limits.nodes.set(node_limit)
+
+    def limit_reached(self):
+        status = self.p.solution.get_status()
+        codes = self.p.solution.status
+        if status in (codes.MIP_time_limit_feasible, codes.MIP_time_limit_infeasible, codes.abort_time_limit):
+            return SolveStatus.timeout
+        if status in (codes.node_limit_feasible, codes.node_limit_infeasible):
+            return SolveStatus.node_limit
+        return None
+
+    def register_branching(self, model, var_idx):
+        p = self.p
+        prefs = self.prefs
+
+        # Register any special branching rules
+        # Must disable CPLEX dynamic search if we have any branching rules
+        if prefs.branch_fathom_too_much_envy or prefs.branch_avg_value or prefs.branch_sos1_envy:
+            p.parameters.mip.strategy.search.set(p.parameters.mip.strategy.search.values.traditional)
+
+        # Can have (TooMuchEnvy fathoming + at most 1 other branching rule)
+        self.branch_callback = None
+        if prefs.branch_fathom_too_much_envy:
+            if prefs.branch_avg_value:
+                self.branch_callback = p.register_callback(MyTooMuchEnvyAndBranchOnAvgItemValue)
+                self.branch_callback.times_too_much_envy_used = 0
+                self.branch_callback.times_branch_on_avg_item_used = 0
+            elif prefs.branch_sos1_envy:
+                self.branch_callback = p.register_callback(MyTooMuchEnvyAndBranchSOS1Envy)
+                self.branch_callback.times_too_much_envy_used = 0
+                self.branch_callback.times_sos1_envy_used = 0
+            else:
+                self.branch_callback = p.register_callback(MyTooMuchEnvyBranch)
+                self.branch_callback.times_used = 0
+        elif prefs.branch_avg_value:
+            self.branch_callback = p.register_callback(MyBranchOnAvgItemValue)
+            self.branch_callback.times_used = 0
+        elif prefs.branch_sos1_envy:
+            self.branch_callback = p.register_callback(MyBranchSOS1Envy)
+            self.branch_callback.times_used = 0
+        if self.branch_callback is not None:
+            self.branch_callback.model = model
+            self.branch_callback.var_idx = var_idx
+            # Tally where too-much-envy fathoming fires, to report if verbose
+            self.branch_callback.fathom_stats = collections.Counter() if prefs.verbose else None
+
+        # Possibly prioritize variables based on their average value (value \propto priority)
+        if prefs.prioritize_avg_value:
+
+            item_positions = sorted(range(model.m), key=lambda k: model.m_avg_vals[k])
+            item_priorities = []
+            for item_idx, position in enumerate(item_positions):
+                # Priority: lowest is 1 (M - last in sorted list), highest is M (M - first=0)
+                priority = model.m - position
+                # Set priorities for each of the binary variables for this item
+                for agent_idx in xrange(model.n):
+                    # order must be a list of triples (variable, priority, direction)
+                    bin_var_idx = int(var_idx[agent_idx, item_idx])
+                    item_priorities.append( (bin_var_idx, priority, p.order.branch_direction.up) )
+
+            p.order.set(item_priorities)
+
+    def branching_stats(self):
+        prefs = self.prefs
+        stats = {}
+
+        # Record stats from the run
+        if prefs.branch_fathom_too_much_envy:
+            if prefs.branch_avg_value:
+                stats['MyTooMuchEnvyBranch'] = self.branch_callback.times_too_much_envy_used
+                stats['MyBranchOnAvgItemValue'] = self.branch_callback.times_branch_on_avg_item_used
+            elif prefs.branch_sos1_envy:
+                stats['MyTooMuchEnvyBranch'] = self.branch_callback.times_too_much_envy_used
+                stats['MyBranchSOS1Envy'] = self.branch_callback.times_sos1_envy_used
+            else:
+                stats['MyTooMuchEnvyBranch'] = self.branch_callback.times_used
+        elif prefs.branch_avg_value:
+            stats['MyBranchOnAvgItemValue'] = self.branch_callback.times_used
+        elif prefs.branch_sos1_envy:
+            stats['MyBranchSOS1Envy'] = self.branch_callback.times_used
+
+        return stats
+
+    def register_lazy_envy(self, form):
+        # Presolve mustn't make dual reductions the lazy rows would invalidate
+        # (1: primal reductions only)
+        self.p.parameters.preprocessing.reduce.set(1)
+        self.lazy_callback = self.p.register_callback(MyLazyEnvy)
+        self.lazy_callback.form = form
+        self.lazy_callback.rows_added = set()
+
+    def lazy_envy_rows_added(self):
+        return len(self.lazy_callback.rows_added) if self.lazy_callback is not None else 0
+
+    def add_mip_start(self, cols, vals):
+        self.p.MIP_starts.add(cplex.SparsePair(ind = list(cols), val = list(vals)),
+                              self.p.MIP_starts.effort_level.repair)
+
+    def tighten_cutoff(self, cutoff):
+        self.cutoff = cutoff if self.cutoff is None else min(self.cutoff, cutoff)
+
+    def solve(self):
+        # Keep track of B&C tree information via MIPInfoCallback
+        self.mip_info = self.p.register_callback(MyMIPInfo)
+        self.mip_info.num_nodes = 0
+
+        if self.cutoff is not None:
+            self.p.parameters.mip.tolerances.uppercutoff.set(self.cutoff)
+
+        start = time.time()
+        self.p.solve()
+        stop = time.time()
+
+        fathom_stats = getattr(self.branch_callback, 'fathom_stats', None)
+        if fathom_stats:
+            print "Fathomed for too much envy at (#envious agents, #items left): {0}".format(
+                ", ".join("{0}: {1}x".format(k, v) for k, v in sorted(fathom_stats.items())))
+
+        # Starts and cutoffs only suit this problem, not the next extension of it
+        if self.p.MIP_starts.get_num() > 0:
+            self.p.MIP_starts.delete()
+        if self.cutoff is not None:
+            self.p.parameters.mip.tolerances.uppercutoff.reset()
+            self.cutoff = None
+        return stop-start
+
+    def has_solution(self):
+        return self.p.solution.is_primal_feasible()
+
+    def objective_value(self):
+        return self.p.solution.get_objective_value()
+
+    def get_values(self, cols):
+        return self.p.solution.get_values(list(cols))
+
+    def num_nodes(self):
+        return self.mip_info.num_nodes
+
+
+class CbcBackend(SolverBackend):
+    """COIN-OR CBC through PuLP: license-free, so we can run one solve on
+    every core.  PuLP models can't grow in place, so incremental loads mean a
+    fresh rebuild; no branching callbacks, and no node counts."""
+
+    def __init__(self, prefs):
+        SolverBackend.__init__(self, prefs)
+        self.x = []
+        self.threads = None
+        self.time_limit = None
+        self.node_limit = None
+        self.start = None
+        self.prob = None
+        self.solve_s = 0.0
+
+    def load(self, form, col_start = 0, row_start = 0, triplets = None):
+        # Formulation.extend updates form in place, so just rebuild it all
+        self.prob = pulp.LpProblem("EnvyFree", pulp.LpMaximize if form.maximize else pulp.LpMinimize)
+
+        # One column per variable
+        self.x = [pulp.LpVariable("x{0}".format(col),
+                                  lowBound = form.lb[col],
+                                  upBound = None if np.isinf(form.ub[col]) else form.ub[col],
+                                  cat = pulp.LpInteger if form.types[col] == "I" else pulp.LpContinuous)
+                  for col in xrange(len(form.obj))]
+        self.prob.setObjective(pulp.LpAffineExpression([(self.x[col], form.obj[col])
+                                                        for col in np.flatnonzero(form.obj)]))
+
+        # One constraint per CSR row of the constraint matrix
+        senses = {"E": pulp.LpConstraintEQ, "G": pulp.LpConstraintGE, "L": pulp.LpConstraintLE}
+        for row in xrange(len(form.rhs)):
+            lo, hi = form.indptr[row], form.indptr[row+1]
+            expr = pulp.LpAffineExpression(zip([self.x[col] for col in form.cols[lo:hi]], form.vals[lo:hi]))
+            self.prob.addConstraint(pulp.LpConstraint(expr, senses[form.senses[row]], rhs = form.rhs[row]))
+
+    def set_threads(self, num_threads):
+        self.threads = num_threads
+
+    def set_limits(self, time_limit, node_limit):
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+
+    def limit_reached(self):
+        # CBC reports "Stopped" without saying on what, so go by the clock
+        if self.prob.status != pulp.LpStatusNotSolved and self.prob.sol_status != pulp.LpSolutionIntegerFeasible:
+            return None
+        if self.time_limit is not None and self.solve_s >= 0.99*self.time_limit:
+            return SolveStatus.timeout
+        return SolveStatus.node_limit if self.node_limit is not None else SolveStatus.timeout
+
+    def add_mip_start(self, cols, vals):
+        # CBC takes a single start, so the latest one wins
+        self.start = (list(cols), list(vals))
+
+    # No tighten_cutoff: CBC already cuts off at its start's value, and 2.9
+    # rejects a start that only just beats an explicit cutoff (see solve)
+
+    def solve(self):
+        if self.start is not None:
+            for col, val in zip(*self.start):
+                self.x[col].setInitialValue(val)
+
+        options = ["maxNodes {0}".format(self.node_limit)] if self.node_limit is not None else []
+        if self.start is not None:
+            # CBC 2.9's preprocessing, cutting off at an optimal start's value,
+            # declares the problem infeasible yet reports a (garbage) optimum
+            options.append("preprocess off")
+
+        solver = pulp.PULP_CBC_CMD(msg = 1 if self.prefs.verbose else 0,
+                                   threads = self.threads,
+                                   maxSeconds = self.time_limit,
+                                   options = options,
+                                   mip_start = self.start is not None)
+        start = time.time()
+        self.prob.solve(solver)
+        stop = time.time()
+        self.start = None
+        self.solve_s = stop-start
+        return self.solve_s
+
+    def has_solution(self):
+        return self.prob.sol_status in (pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible)
+
+    def objective_value(self):
+        return pulp.value(self.prob.objective) or 0.0
+
+    def get_values(self, cols):
+        return [self.x[col].varValue for col in cols]
+
+
+def new_backend(prefs):
+    """Creates the solver backend selected by prefs.solver"""
+
+    if prefs.solver == SolverType.cplex:
+        if cplex is None:
+            raise ImportError("no module named cplex; try --solver-cbc for a license-free solver")
+        backend = CplexBackend(prefs)
+    elif prefs.solver == SolverType.cbc:
+        if pulp is None:
+            raise ImportError("no module named pulp, which ships the CBC solver")
+        backend = CbcBackend(prefs)
+    else:
+        raise Exception("Solver type {0} is not recognized.".format(prefs.solver))
+
+    backend.set_threads(prefs.num_threads)
+    backend.set_limits(prefs.time_limit, prefs.node_limit)
+    return backend
@@ -1,4 +1,22 @@
 import time
+import numpy as np
+
+class ScreenTest:
+    """Which bound, if any, proved an instance infeasible before solving"""
+    none, too_few_items, contested_top_item, proportionality = range(4)
+
+
+def too_few_items_feasible(model):
+    """With $M < N$ items, at least $N-M$ agents get nothing, and each of them
+    envies some other bundle unless she values every item at zero."""
+
+    start = time.time()
+    num_indifferent = np.count_nonzero(model.n_max_vals <= 0)
+    is_possibly_feasible = (model.m >= model.n or num_indifferent >= model.n - model.m)
+    stop = time.time()
+
+    return (is_possibly_feasible, stop-start)
+
 
 def max_contested_feasible(model):
     """If for each item $j \in [M'] \subseteq [M]$ there are $k_j > 0$ agents 
@@ -10,19 +28,19 @@ def max_contested_feasible(model):
     # Track bound runtime
     start = time.time()
 
-    # Determine contested items, and how many agents contest each item
-    conflict_counts = {}
-    for u in model.u:
-        max_idx = max(enumerate(u),key=lambda idx_val_pair: idx_val_pair[1])[0]
-        if max_idx not in conflict_counts:
-            conflict_counts[max_idx] = 1
-        else:
-            conflict_counts[max_idx] += 1
+    # Determine contested items, and how many agents contest each item;
+    # an agent with tied top items doesn't necessarily want any one of them
+    if model.m > 1:
+        runner_up_vals = np.partition(model.u, -2, axis=1)[:,-2]
+        has_top_item = model.n_max_vals > runner_up_vals
+    else:
+        has_top_item = np.ones(model.n, dtype=bool)
+    conflict_counts = np.bincount(np.argmax(model.u[has_top_item], axis=1), minlength=model.m)
 
     # \sum_j 2k_j - 1     for any item j with k_j > 1 conflicts
-    min_item_ct = 0
-    for item, conflict_count in conflict_counts.items():
-        min_item_ct += 2*conflict_count - 1   # works for k_j = 1, too
+    # (works for k_j = 1, too)
+    contested = conflict_counts[conflict_counts > 0]
+    min_item_ct = np.sum(2*contested - 1)
     
     stop = time.time()
 
@@ -33,3 +51,45 @@ def max_contested_feasible(model):
     runtime = stop-start
 
     return (is_possibly_feasible, runtime)
+
+
+def proportional_feasible(model):
+    """An envy-free allocation of all items is proportional: agent $i$ values
+    her bundle at least $1/N$ of her value for all items.  If $k_i$ is the
+    fewest items that get $i$ there (taking her favourites first), then
+    $M < \sum_i k_i$ means no envy-free allocation exists."""
+
+    start = time.time()
+
+    # best_vals[i,k] is agent i's value for her k+1 favourite items
+    best_vals = np.cumsum(-np.sort(-model.u, axis=1), axis=1)
+    shares = best_vals[:,-1] / model.n
+
+    # k_i = 1 + #{k : best_vals[i,k] < share_i}, for agents who value anything
+    needy = shares > 0
+    min_item_ct = np.count_nonzero(needy) + np.count_nonzero(best_vals[needy] + 1e-6 < shares[needy,np.newaxis])
+
+    stop = time.time()
+
+    is_possibly_feasible = (model.m >= min_item_ct)
+    return (is_possibly_feasible, stop-start)
+
+
+def screen(model):
+    """Runs our cheap sufficient conditions for infeasibility, cheapest first;
+    returns the ScreenTest that fired (or ScreenTest.none) and the total
+    screening runtime"""
+
+    tests = [(ScreenTest.too_few_items, too_few_items_feasible),
+             (ScreenTest.contested_top_item, max_contested_feasible),
+             (ScreenTest.proportionality, proportional_feasible),
+             ]
+
+    runtime = 0.0
+    for screen_test, test in tests:
+        is_possibly_feasible, test_s = test(model)
+        runtime += test_s
+        if not is_possibly_feasible:
+            return (screen_test, runtime)
+
+    return (ScreenTest.none, runtime)
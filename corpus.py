@@ -0,0 +1,66 @@
+import numpy as np
+import os
+from model import Model
+from npz_io import save_npz
+
+
+def instance_seed(seed, num_agents, num_items):
+    """A grid cell's own seed, so its instances don't depend on which process
+    draws them, or on what was drawn before"""
+    return ((seed * 1000003 + num_agents) * 1000003 + num_items) % 2**32
+
+
+class InstanceCache:
+    """A directory of drawn instances, one compressed .npz file per batch,
+    named by everything that determines its contents (distribution, duplicate
+    handling, seed, #agents, #items, #repeats); a file only ever holds what
+    draw_instances would draw for its name, so any run that finds it there
+    solves exactly the same inputs."""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Another process got there first
+                if not os.path.isdir(dirname):
+                    raise
+
+    def filename(self, seed, num_instances, num_agents, num_items, dist_type, dup_values):
+        return os.path.join(self.dirname, "dist{0}_dup{1}_seed{2}_n{3}_m{4}_r{5}.npz".format(
+                dist_type, dup_values, seed, num_agents, num_items, num_instances))
+
+    def load(self, seed, num_instances, num_agents, num_items, dist_type, dup_values):
+        """Returns the cached (utilities, profile ids or None), or None"""
+        filename = self.filename(seed, num_instances, num_agents, num_items, dist_type, dup_values)
+        if not os.path.exists(filename):
+            return None
+        with np.load(filename) as f:
+            return f['utilities'], (f['profile_ids'] if 'profile_ids' in f else None)
+
+    def save(self, seed, num_instances, num_agents, num_items, dist_type, dup_values, utilities, profile_ids):
+        filename = self.filename(seed, num_instances, num_agents, num_items, dist_type, dup_values)
+        arrays = {'utilities': utilities}
+        if profile_ids is not None:
+            arrays['profile_ids'] = profile_ids
+        save_npz(filename, arrays, compressed=True)
+
+
+def draw_instances(seed, num_instances, num_agents, num_items, dist_type, dup_values, cache = None):
+    """Draws the grid cell's batch of instances from its own seed (see
+    Model.generate_batch, with return_profiles), or loads it from the cache,
+    if given one; newly drawn batches are added to the cache"""
+
+    if cache is not None:
+        cached = cache.load(seed, num_instances, num_agents, num_items, dist_type, dup_values)
+        if cached is not None:
+            return cached
+
+    np.random.seed(instance_seed(seed, num_agents, num_items))
+    utilities, profile_ids = Model.generate_batch(num_instances, num_agents, num_items, dist_type, dup_values,
+                                                  return_profiles = True)
+
+    if cache is not None:
+        cache.save(seed, num_instances, num_agents, num_items, dist_type, dup_values, utilities, profile_ids)
+    return utilities, profile_ids
@@ -4,11 +4,20 @@ from model import Model
 from model import DupValues
 from model import DistTypes
 from model import ObjType
+from backends import no_branching_stats, SolverType, SolveStatus
 import allocator
 import bounds
+import heuristics
+import workers
+import manifest
+from journal import Journal
+from corpus import InstanceCache, draw_instances
 from allocator import DoesNotExistException
 import argparse
-import random
+import json
+import hashlib
+import shlex
+import os
 
 import time
 import csv
@@ -16,39 +25,323 @@ import sys
 
 current_ms_time = lambda: int(round(time.time() * 1000))
 
-def run(num_agents, num_items, prefs, dup_values):
-
-    # Randomly generate some data for N agents and M items
-    if prefs.dist_type == DistTypes.urand_int:
-        m = Model.generate_urand_int(num_agents, num_items, dup_values)
-    elif prefs.dist_type == DistTypes.urand_real:
-        m = Model.generate_urand_real(num_agents, num_items, dup_values)
-    elif prefs.dist_type == DistTypes.zipf_real:
-        m = Model.generate_zipf_real(num_agents, num_items, 2., dup_values)
-    elif prefs.dist_type == DistTypes.polya_urn_real:
-        m = Model.generate_polya_urn_real(num_agents, num_items, 2, 1)
-    elif prefs.dist_type == DistTypes.correlated_real:
-        m = Model.generate_correlated_real(num_agents, num_items)
-    else:
-        raise Exception("Distribution type {0} is not recognized.".format(prefs.dist_type))
+def _unsolved_stats(feasible):
+    """Stats for an instance settled without building or solving an IP"""
+    stats = no_branching_stats()
+    stats.update({'ModelBuildTime':0.0, 'ModelSolveTime':0.0, 'MIPNodeCount':0, 'MIPObjVal':0,
+                  'ModelFeasible':feasible, 'EnvyRows':0,
+                  'SolveStatus':SolveStatus.feasible if feasible else SolveStatus.infeasible})
+    return stats
+
+
+def run(m, prefs, incremental = None, shared = None):
+    """Solves one instance under prefs; to solve it again under other prefs,
+    pass the same shared dict each time, which keeps the screening, heuristic
+    and IP formulation results they have in common"""
+
+    if shared is None:
+        shared = {}
 
     # Do our bounding at the root to check for naive infeasibility
-    #is_possibly_feasible, bounding_s = bounds.max_contested_feasible(m)
-    #if not is_possibly_feasible:
-    #    print "Bounded infeasible!"
-    #    sys.exit(-1)
-
-    # Compute an envy-free allocation (if it exists)
-    stats = allocator.allocate(m, prefs)
-    
+    if prefs.screen:
+        if 'screen' not in shared:
+            shared['screen'] = bounds.screen(m)
+        screen_test, screen_s = shared['screen']
+    else:
+        screen_test, screen_s = bounds.ScreenTest.none, 0.0
+
+    # Then try cheap constructions, which often find an E-F allocation outright
+    owner, heuristic_solved, heuristic_s = None, False, 0.0
+    if screen_test == bounds.ScreenTest.none and prefs.heuristic:
+        if 'heuristic' not in shared:
+            shared['heuristic'] = heuristics.find_allocation(m)
+        owner, envy_free, candidates, heuristic_s = shared['heuristic']
+        # Only settles existence; welfare still needs the IP (from this start)
+        heuristic_solved = envy_free and prefs.obj_type == ObjType.feasibility
+
+        # Otherwise seed the IP with the best of the allocations we tried
+        if not heuristic_solved and prefs.solver != SolverType.native:
+            owner = heuristics.best_start(m, candidates, prefs.obj_type, prefs.alternate_IP_model)
+
+    if screen_test != bounds.ScreenTest.none:
+        # Bounded infeasible!  No need to build or solve anything
+        stats = _unsolved_stats(False)
+    elif heuristic_solved:
+        # Found (and verified) an envy-free allocation without the IP
+        stats = _unsolved_stats(True)
+        if prefs.verbose:
+            print "Envy-free allocation: {0}".format(owner.tolist())
+    elif incremental is not None:
+        # Compute an envy-free allocation (if it exists) by extending the
+        # previous, smaller instance of a nested sweep
+        stats = incremental.allocate(m, owner)
+    else:
+        stats = allocator.allocate(m, prefs, owner, shared.setdefault('formulations', {}))
+
+    stats['ScreenTest'], stats['ScreenTime'] = screen_test, screen_s
+    stats['HeuristicSolved'], stats['HeuristicTime'] = heuristic_solved, heuristic_s
     return stats
 
 
 
+def sweep_cells(args):
+    """Splits the sweep into grid cells (#agents, [#items, ...]), each solving
+    every repeat; a nested sweep's cell holds all of an #agents' items, since
+    each solve builds on the last"""
+
+    cells = []
+    for num_agents in range(args.N[0], args.N[1], args.N[2]):
+        # Never feasible if fewer items than agents
+        items_list = [num_items for num_items in range(args.M[0], args.M[1], args.M[2]) if num_items >= num_agents]
+        if len(items_list) == 0:
+            continue
+        if args.nested_items:
+            cells.append((num_agents, items_list))
+        else:
+            cells.extend((num_agents, [num_items]) for num_items in items_list)
+    return cells
+
+
+# Options that say what to run and where, rather than how to run each task
+RUN_OPTIONS = ('filename', 'seed', 'N', 'M', 'workers', 'manifest', 'shard', 'write_manifest', 'resume',
+               'instance_cache')
+
+def task_config(args):
+    """The options a manifest task runs with, as JSON"""
+    return json.dumps(dict((k, v) for k, v in vars(args).items() if k not in RUN_OPTIONS), sort_keys=True)
+
+def task_args(args, seed, config):
+    """Rebuilds a manifest task's options from its seed and JSON config, and
+    the run options of this run (args)"""
+    cell_args = argparse.Namespace(**json.loads(config))
+    for option in RUN_OPTIONS:
+        setattr(cell_args, option, getattr(args, option))
+    cell_args.seed = seed
+    return cell_args
+
+def repeat_key(task, repeat):
+    """Identifies one repeat of a task (task id, its options, its grid cell,
+    ...) by what it runs, so a resumed run only skips repeats it would
+    otherwise solve again"""
+    cell_args, cell = task[1], task[2]
+    return hashlib.sha1(json.dumps([cell_args.seed, cell, task_config(cell_args), repeat])).hexdigest()
+
+def cell_num_rows(args, cell):
+    """How many csv rows run_cell writes for the cell"""
+    num_agents, items_list = cell
+    return len(items_list) * args.num_repeats * len(config_args(args))
+
+
+# Options that say which instances to solve, so every configuration shares them
+INSTANCE_OPTIONS = ('seed', 'N', 'M', 'num_repeats', 'dist_type', 'nested_items')
+
+def config_overrides(parser, args, flags):
+    """The options a --config FLAGS changes from the command line, as a dict"""
+    config = parser.parse_args(shlex.split(flags), namespace = argparse.Namespace(**vars(args)))
+    return dict((k, v) for k, v in vars(config).items() if v != getattr(args, k, None))
+
+def config_args(args):
+    """The options of each configuration to solve with: the command line's,
+    updated by each of its --configs (or just the command line's)"""
+    if not args.configs:
+        return [args]
+    configs = []
+    for overrides in args.configs:
+        config = argparse.Namespace(**vars(args))
+        for k, v in overrides.items():
+            setattr(config, k, v)
+        configs.append(config)
+    return configs
+
+
+def run_task(args, task):
+    """Runs a task (task id, its options, its grid cell, the repeats already
+    done), yielding each other repeat's (journal key, csv rows) as it
+    finishes, each row ending with the task id (-1 if not from a manifest)"""
+    task_id, cell_args, cell, done_repeats = task
+    for repeat, rows in run_cell(cell_args, cell, done_repeats):
+        yield repeat_key(task, repeat), [row + [task_id] for row in rows]
+
+
+def run_cell(args, cell, skip_repeats = ()):
+    """Solves every repeat of one grid cell but those in skip_repeats,
+    yielding each one's (repeat, CSV rows) once all its #items and
+    configurations are done"""
+
+    num_agents, items_list = cell
+
+    # How to handle duplicate valuations for different items by the same agent?
+    dup_values = DupValues.allowed
+
+    # Where to look up instances before drawing them
+    cache = InstanceCache(args.instance_cache) if args.instance_cache is not None else None
+
+    # Write one row per run, or one row per N runs (aggregate)?
+    write_all = True
+
+    configs = config_args(args)
+
+    # Stats of each configuration's runs at each #items
+    config_stats = dict((num_items, [[] for _ in configs]) for num_items in items_list)
+
+    # Each #items' repeat instances, all drawn at once the first time they're
+    # needed (a nested sweep draws them over all items, once)
+    batches = {}
+
+    for repeat in xrange(args.num_repeats):
+        if repeat in skip_repeats:
+            continue
+        rows = []
+
+        # Nested sweep: keep one IP per configuration alive as items are added
+        if args.nested_items:
+            incrementals = [allocator.IncrementalAllocator(config) for config in configs]
+
+        # Phase transition plots runtime, %feas vs. #items
+        for num_items in items_list:
+
+            batch_items = max(items_list) if args.nested_items else num_items
+            if batch_items not in batches:
+                batches[batch_items] = draw_instances(args.seed, args.num_repeats, num_agents, batch_items,
+                                                      args.dist_type, dup_values, cache)
+
+            # Solve the instance under every configuration, sharing whatever
+            # work they have in common
+            utilities, profile_ids = batches[batch_items]
+            m = Model(utilities[repeat,:,:num_items], num_items, args.dist_type, dup_values,
+                      None if profile_ids is None else profile_ids[repeat])
+            shared = {}
+            for config_idx, config in enumerate(configs):
+                stats = run(m, config, incrementals[config_idx] if args.nested_items else None, shared)
+                config_stats[num_items][config_idx].append(stats)
+
+                # If we're recording ALL data, write details for this one run
+                if write_all:
+                    rows.append([config.seed, config.num_threads,
+                                 num_agents, num_items, config.alternate_IP_model,
+                                 config.dist_type, config.num_repeats, config.obj_type, 
+                                 config.branch_fathom_too_much_envy, stats['MyTooMuchEnvyBranch'],
+                                 config.branch_avg_value, stats['MyBranchOnAvgItemValue'],
+                                 config.branch_sos1_envy, stats['MyBranchSOS1Envy'],
+                                 config.prioritize_avg_value,
+                                 stats['ModelFeasible'], stats['MIPNodeCount'], stats['ModelBuildTime'], stats['ModelSolveTime'], stats['MIPObjVal'],
+                                 stats['ScreenTest'], stats['ScreenTime'],
+                                 stats['HeuristicSolved'], stats['HeuristicTime'],
+                                 stats['SolveStatus'], stats['EnvyRows'],
+                                 config_idx,
+                                 ])
+
+        if write_all:
+            yield repeat, rows
+
+    # Report stats over the runs of each #items, both to stdout and to out.csv
+    rows = []
+    for num_items in items_list:
+        for config_idx, config in enumerate(configs):
+            runs = config_stats[num_items][config_idx]
+            if len(runs) == 0:
+                continue
+            sol_exists_accum = sum(1 for stats in runs if stats['ModelFeasible'])
+            build_s = [stats['ModelBuildTime'] for stats in runs]
+            solve_s = [stats['ModelSolveTime'] for stats in runs]
+            build_s_avg, build_s_min, build_s_max = sum(build_s) / len(runs), min(build_s), max(build_s)
+            solve_s_avg, solve_s_min, solve_s_max = sum(solve_s) / len(runs), min(solve_s), max(solve_s)
+
+            if args.verbose == True:
+                if len(configs) > 1:
+                    print "Configuration {0}:".format(config_idx)
+                print "Build Avg: {0:3f}, Min: {1:3f}, Max: {2:3f}".format(build_s_avg, build_s_min, build_s_max)
+                print "Solve Avg: {0:3f}, Min: {1:3f}, Max: {2:3f}".format(solve_s_avg, solve_s_min, solve_s_max)
+                print "N={0}, M={1}, fraction feasible: {2} / {3}".format(num_agents, num_items, sol_exists_accum, len(runs))
+
+            # If we're only writing aggregate data, write that now
+            if not write_all:
+                rows.append([config.seed, num_agents, num_items, config.alternate_IP_model,
+                             config.dist_type, config.num_repeats, config.obj_type, 
+                             config.branch_fathom_too_much_envy,
+                             config.branch_avg_value,
+                             sol_exists_accum, 
+                             build_s_avg, build_s_min, build_s_max,
+                             solve_s_avg, solve_s_min, solve_s_max,
+                             ])
+
+    # (aggregate rows cover the whole cell, so are journaled as no one repeat)
+    if not write_all:
+        yield None, rows
+
+
+
+def check_config(args):
+    """Exits on options that can't be used together"""
+
+    if args.alternate_IP_model \
+            and (args.obj_type != ObjType.feasibility \
+                     or args.branch_fathom_too_much_envy \
+                     or args.branch_avg_value \
+                     or args.branch_sos1_envy):
+        print "Argument error: running the alternate IP model (--alternate-IP-model) disallows" \
+            " any objective other than feasibility (--obj-feas); furthermore, we haven't" \
+            " implemented any branching rules for the alternate IP model yet (--fathom-too-much-envy," \
+            " --branch-avg-value, --branch-sos1-envy)"
+        sys.exit(-1)
+
+    if args.solver != SolverType.cplex \
+            and ((args.branch_fathom_too_much_envy and args.solver != SolverType.native) \
+                     or args.branch_avg_value \
+                     or args.branch_sos1_envy \
+                     or args.prioritize_avg_value):
+        print "Argument error: custom branching rules and priorities (--fathom-too-much-envy," \
+            " --branch-avg-value, --branch-sos1-envy, --prioritize-avg-value) need CPLEX callbacks" \
+            " (--solver-cplex); the native branch and bound (--solver-native) has its own" \
+            " --fathom-too-much-envy"
+        sys.exit(-1)
+
+    if args.solver == SolverType.native \
+            and (args.obj_type != ObjType.feasibility \
+                     or args.alternate_IP_model \
+                     or args.nested_items \
+                     or args.aggregate_items \
+                     or args.lazy_envy):
+        print "Argument error: the native branch and bound (--solver-native) only decides existence" \
+            " (--obj-feas), without an IP (--alternate-IP-model, --nested-items, --aggregate-items, --lazy-envy)"
+        sys.exit(-1)
+
+    if args.aggregate_items \
+            and (args.branch_fathom_too_much_envy \
+                     or args.branch_avg_value \
+                     or args.branch_sos1_envy \
+                     or args.prioritize_avg_value):
+        print "Argument error: custom branching rules and priorities (--fathom-too-much-envy," \
+            " --branch-avg-value, --branch-sos1-envy, --prioritize-avg-value) work on one binary" \
+            " variable per item, so can't be used with --aggregate-items"
+        sys.exit(-1)
+
+    if args.nested_items and args.lazy_envy:
+        print "Argument error: nested instances (--nested-items) grow one IP with all its envy rows," \
+            " so can't add them lazily (--lazy-envy)"
+        sys.exit(-1)
+
+    if args.nested_items and args.dist_type == DistTypes.urand_int:
+        print "Argument error: nested instances (--nested-items) need item values that don't" \
+            " depend on the number of items, so can't use --dist-urand-int"
+        sys.exit(-1)
+
+    if (args.time_limit is not None and args.time_limit <= 0) \
+            or (args.node_limit is not None and args.node_limit <= 0):
+        print "Argument error: solve budgets (--time-limit, --node-limit) must be positive"
+        sys.exit(-1)
+
+    # Configurations only change how each instance is solved
+    if any(option in config for config in (args.configs or []) for option in INSTANCE_OPTIONS):
+        print "Argument error: configurations (--config) can't change which instances are solved" \
+            " (--seed, -n, -m, --num_repeats, the --dist-* options, --nested-items)"
+        sys.exit(-1)
+
+
 def main():
 
     parser = argparse.ArgumentParser(description='Find envy-free allocations.')
-    parser.add_argument("-f", "--filename", dest="filename", required=True,
+    parser.add_argument("-f", "--filename", dest="filename",
                       metavar="FILE", help="write comma-delimited csv output to FILE")
     parser.add_argument("-r", "--num_repeats", type=int, dest="num_repeats", default=10,
                       metavar="R", help="num repeat runs per parameter setting")
@@ -71,118 +364,134 @@ def main():
     parser.add_argument("--dist-correlated-real", action="store_const", const=DistTypes.correlated_real, dest="dist_type", default=DistTypes.urand_real,
                         help="Utility distribution correlated intrinsic item value.")
     parser.add_argument("-s", "--seed", type=long, dest="seed", default=0,
-                        help="Sets the random seed in Python")
+                        help="Seeds the instance sampler (each grid cell draws from its own seed derived from it)")
     parser.add_argument("--fathom-too-much-envy", action="store_true", dest="branch_fathom_too_much_envy", default=False,
                         help="Fathoms a path if #unallocated items is less than #envious agents at node")
     parser.add_argument("--branch-avg-value", action="store_true", dest="branch_avg_value", default=False,
                         help="Branching based on average item value and max agent value")
     parser.add_argument("--branch-sos1-envy", action="store_true", dest="branch_sos1_envy", default=False,
-                        help="SOS1 branch to most envious agent [NOT IMPLEMENTED]")
+                        help="Declares each item's variables an SOS1 set, and branches on the items the most envious agent envies.")
     parser.add_argument("--prioritize-avg-value", action="store_true", dest="prioritize_avg_value", default=False,
                         help="Sets CPLEX branching priority based on average item value.")
     parser.add_argument("--alternate-IP-model", action="store_true", dest="alternate_IP_model", default=False,
                         help="Solves an alternate IP model.")
+    parser.add_argument("--no-screen", action="store_false", dest="screen", default=True,
+                        help="Solves every instance, even those our cheap bounds prove infeasible.")
+    parser.add_argument("--lazy-envy", action="store_true", dest="lazy_envy", default=False,
+                        help="Starts with one envy constraint per agent and adds the others only once a solution violates them.")
+    parser.add_argument("--aggregate-items", action="store_true", dest="aggregate_items", default=False,
+                        help="Merges items every agent values the same into one integer variable per agent, counting how many of them she gets.")
+    parser.add_argument("--break-symmetry", action="store_true", dest="break_symmetry", default=False,
+                        help="Searches just one of each set of allocations that permuting identical agents or items makes equivalent.")
+    parser.add_argument("--no-heuristic", action="store_false", dest="heuristic", default=True,
+                        help="Skips the constructive heuristics that settle many instances (and warm-start the rest) before solving.")
+    parser.add_argument("--nested-items", action="store_true", dest="nested_items", default=False,
+                        help="Each repeat draws one instance with every item in the -m range; each #items solves its first #items, re-using the previous IP and allocation.")
+    parser.add_argument("--solver-cplex", action="store_const", const=SolverType.cplex, dest="solver", default=SolverType.cplex,
+                        help="Solves the IP with CPLEX (needs a license).")
+    parser.add_argument("--solver-cbc", action="store_const", const=SolverType.cbc, dest="solver", default=SolverType.cplex,
+                        help="Solves the IP with the license-free CBC solver shipped with PuLP (no custom branching).")
+    parser.add_argument("--solver-native", action="store_const", const=SolverType.native, dest="solver", default=SolverType.cplex,
+                        help="Decides existence with our own NumPy branch and bound instead of an IP (--obj-feas only).")
     parser.add_argument("-v", "--verbose", action="store_true", dest="verbose", default=False,
                         help="Prints a bunch of stats to stdout as we solve models.")
     parser.add_argument("-t", "--num-threads", type=int, default=1, dest="num_threads",
-                        help="Sets the number of threads used by CPLEX.")
+                        help="Sets the number of threads used by the IP solver.")
+    parser.add_argument("--time-limit", type=float, dest="time_limit", metavar="SECS",
+                        help="Stops each solve after SECS seconds, recording a timeout.")
+    parser.add_argument("--node-limit", type=int, dest="node_limit", metavar="NODES",
+                        help="Stops each solve after NODES branch-and-bound nodes, recording a node limit.")
+    parser.add_argument("-c", "--config", action="append", dest="configs", metavar="FLAGS",
+                        help="Solves every instance under this configuration, given as extra options (e.g. --config=\"--branch-avg-value\"); repeat for several, one csv row each.")
+    parser.add_argument("-w", "--workers", type=int, default=1, dest="workers",
+                        help="Spreads the grid cells (#agents, #items) over this many processes.")
+    parser.add_argument("--write-manifest", dest="write_manifest", metavar="MANIFEST",
+                        help="Instead of solving, appends this sweep's tasks (one per grid cell) to MANIFEST.")
+    parser.add_argument("--manifest", dest="manifest", metavar="MANIFEST",
+                        help="Runs the tasks in MANIFEST instead of the sweep given by the other options.")
+    parser.add_argument("--instance-cache", dest="instance_cache", metavar="DIR",
+                        help="Loads each grid cell's instances from DIR if there, and saves newly drawn ones there.")
+    parser.add_argument("--resume", action="store_true", dest="resume", default=False,
+                        help="Picks up a killed run: skips the repeats its journal (FILE.journal) lists as done and appends to FILE.")
+    parser.add_argument("--shard", type=manifest.parse_shard, dest="shard", metavar="i/k",
+                        help="Runs only the i-th of k (0 <= i < k) disjoint slices of the tasks.")
                       
     args = parser.parse_args()
 
-    if args.alternate_IP_model \
-            and (args.obj_type != ObjType.feasibility \
-                     or args.branch_fathom_too_much_envy \
-                     or args.branch_avg_value \
-                     or args.branch_sos1_envy):
-        print "Argument error: running the alternate IP model (--alternate-IP-model) disallows" \
-            " any objective other than feasibility (--obj-feas); furthermore, we haven't" \
-            " implemented any branching rules for the alternate IP model yet (--fathom-too-much-envy," \
-            " --branch-avg-value, --branch-sos1-envy)"
+    # Each configuration to solve with is the command line plus its --config
+    if args.configs is not None:
+        args.configs = [config_overrides(parser, args, flags) for flags in args.configs]
+    for config in config_args(args):
+        check_config(config)
+
+    if args.workers < 1:
+        print "Argument error: need at least one worker process (--workers)"
         sys.exit(-1)
 
-    # If a random seed was explicitly passed in, set it
-    if hasattr(args, "seed"):
-        random.seed(args.seed)
-    else:
-        random.seed()
+    if (args.filename is None) == (args.write_manifest is None) \
+            or (args.manifest is not None and args.write_manifest is not None):
+        print "Argument error: either solve (--filename), possibly from a manifest (--manifest)," \
+            " or write a manifest (--write-manifest)"
+        sys.exit(-1)
 
-    # How to handle duplicate valuations for different items by the same agent?
-    dup_values = DupValues.allowed
+    # Just list this sweep's tasks, to be run (and sharded) later?
+    if args.write_manifest is not None:
+        config = task_config(args)
+        task_ids = manifest.append(args.write_manifest,
+                                   [(args.seed, num_agents, items_list, cell_num_rows(args, (num_agents, items_list)), config)
+                                    for num_agents, items_list in sweep_cells(args)])
+        print "Wrote tasks {0}-{1} to {2}".format(task_ids[0], task_ids[-1], args.write_manifest) if task_ids \
+            else "No tasks to write"
+        return
 
-    # Write one row per run, or one row per N runs (aggregate)?
-    write_all = True
+    # Record finished repeats, and pick up after those of an earlier, killed run
+    journal = Journal(args.filename + ".journal", resume = args.resume)
+    if args.resume and journal.csv_size > (os.path.getsize(args.filename) if os.path.exists(args.filename) else 0):
+        print "Error: {0} is shorter than its journal says; can't resume".format(args.filename)
+        sys.exit(-1)
+
+    with open(args.filename, 'ab' if args.resume else 'wb') as csvfile:
 
-    with open(args.filename, 'wb') as csvfile:
+        # Cut off rows of any repeat that hadn't finished
+        csvfile.truncate(journal.csv_size)
 
         # Write overall stats to out.csv
         writer = csv.writer(csvfile, delimiter=',')
 
-        for num_agents in range(args.N[0], args.N[1], args.N[2]):
-
-            # Phase transition plots runtime, %feas vs. #items
-            for num_items in range(args.M[0], args.M[1], args.M[2]):
-            
-                # Never feasible if fewer items than agents
-                if num_items < num_agents:
-                    continue
-
-                build_s_accum = solve_s_accum = 0.0
-                build_s_min = solve_s_min = 10000.0
-                build_s_max = solve_s_max = -1.0
-                sol_exists_accum = 0
-                for _ in xrange(args.num_repeats):
-
-                    # Generate an instance and solve it; returns runtime of IP write+solve
-                    stats = run(num_agents, num_items, args, dup_values)
-
-                    sol_exists, build_s, solve_s = stats['ModelFeasible'], stats['ModelBuildTime'], stats['ModelSolveTime']
-
-                    # Maintain stats on the runs
-                    sol_exists_accum += 1 if sol_exists else 0
-                    build_s_accum += build_s
-                    solve_s_accum += solve_s
-                    if build_s < build_s_min:
-                        build_s_min = build_s
-                    if solve_s < solve_s_min:
-                        solve_s_min = solve_s
-                    if build_s > build_s_max:
-                        build_s_max = build_s
-                    if solve_s > solve_s_max:
-                        solve_s_max = solve_s
-
-                    # If we're recording ALL data, write details for this one run
-                    if write_all:
-                        writer.writerow([args.seed, args.num_threads,
-                                         num_agents, num_items, args.alternate_IP_model,
-                                         args.dist_type, args.num_repeats, args.obj_type, 
-                                         args.branch_fathom_too_much_envy, stats['MyTooMuchEnvyBranch'],
-                                         args.branch_avg_value, stats['MyBranchOnAvgItemValue'],
-                                         args.branch_sos1_envy, stats['MyBranchSOS1Envy'],
-                                         args.prioritize_avg_value,
-                                         sol_exists, stats['MIPNodeCount'], build_s, solve_s, stats['MIPObjVal']
-                                         ])
-                        csvfile.flush()
-
-                # Report stats over all N runs, both to stdout and to out.csv
-                build_s_avg = build_s_accum / args.num_repeats
-                solve_s_avg = solve_s_accum / args.num_repeats
-
-                if args.verbose == True:
-                    print "Build Avg: {0:3f}, Min: {1:3f}, Max: {2:3f}".format(build_s_avg, build_s_min, build_s_max)
-                    print "Solve Avg: {0:3f}, Min: {1:3f}, Max: {2:3f}".format(solve_s_avg, solve_s_min, solve_s_max)
-                    print "N={0}, M={1}, fraction feasible: {2} / {3}".format(num_agents, num_items, sol_exists_accum, args.num_repeats)
-
-                # If we're only writing aggregate data, write that now
-                if not write_all:
-                    writer.writerow([args.seed, num_agents, num_items, args.alternate_IP_model,
-                                     args.dist_type, args.num_repeats, args.obj_type, 
-                                     args.branch_fathom_too_much_envy,
-                                     args.branch_avg_value,
-                                     sol_exists_accum, 
-                                     build_s_avg, build_s_min, build_s_max,
-                                     solve_s_avg, solve_s_min, solve_s_max,
-                                     ])
-                csvfile.flush()
+        # Run the manifest's tasks, or the grid cells of our sweep
+        if args.manifest is not None:
+            tasks = [(task_id, task_args(args, seed, config), (num_agents, items_list))
+                     for task_id, seed, num_agents, items_list, _, config in manifest.read(args.manifest)]
+        else:
+            tasks = [(-1, args, cell) for cell in sweep_cells(args)]
+        if args.shard is not None:
+            tasks = manifest.shard(tasks, *args.shard)
+
+        # Hand each task the repeats it already finished, and drop the done ones
+        unfinished = []
+        for task in tasks:
+            done_repeats = set(repeat for repeat in xrange(task[1].num_repeats) if journal.is_done(repeat_key(task, repeat)))
+            if len(done_repeats) < task[1].num_repeats:
+                unfinished.append(task + (done_repeats,))
+
+        # Run them here, or spread them over worker processes and write each
+        # repeat's rows as they come back
+        if args.workers > 1:
+            results = workers.run_tasks(run_task, args, unfinished, args.workers)
+        else:
+            results = ((task, part, None) for task in unfinished for part in run_task(args, task))
+
+        for (task_id, cell_args, (num_agents, items_list), _), part, error in results:
+            if error is not None:
+                print >> sys.stderr, "Task {0} (N={1}, M={2}) failed; skipping the rest of it:\n{3}".format(task_id, num_agents, items_list, error)
+                continue
+            key, rows = part
+            writer.writerows(rows)
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+            journal.record(key, os.fstat(csvfile.fileno()).st_size)
+
+    journal.close()
 
 
 if __name__ == '__main__':
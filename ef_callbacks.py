@@ -1,6 +1,6 @@
 import cplex
-from cplex.callbacks import BranchCallback, MIPInfoCallback
-import sys
+from cplex.callbacks import BranchCallback, LazyConstraintCallback, MIPInfoCallback
+import numpy as np
 
 # General note [C API vs. Python API]:
 # Are we indexing into the original model or the reduced/presolved model?
@@ -8,19 +8,191 @@ import sys
 # Source: http://pic.dhe.ibm.com/infocenter/cosinfoc/v12r2/index.jsp?topic=/ilog.odms.cplex.help/Content/Optimization/Documentation/CPLEX/_pubskel/CPLEX980.html
 
 
+class NodeState:
+    """What our branch callbacks know about a node of the B&B tree.  It stores
+    a bitmask (np.packbits order) of the items fixed to an agent
+    in the node's subtree, own[i], agent i's value for her fixed bundle, and
+    delta, what the branch into the node changed on top of its parent's
+    state, as (item, agent, fixed) for x_{ij} fixed to 1 or to 0.
+
+    Who owns which item, how far down each item's value order our
+    item-value branching has ruled agents out (see _item_orders), and every
+    agent's value for every bundle are derived when a callback first needs
+    them, from the nearest ancestor's derived copy plus the deltas since
+    (normally just the parent's and this node's), and kept until all of the
+    node's children have derived theirs.  States are otherwise never
+    changed once made."""
+
+    def __init__(self, assigned, own, num_assigned, delta, parent = None):
+        self.assigned = assigned
+        self.own = own
+        self.num_assigned = num_assigned
+        self.delta = delta
+        self.parent = parent
+        self.derived = None          # (owner, next_agent, V), once needed
+        self.pending_children = 0    # children yet to derive theirs from it
+
+    @staticmethod
+    def from_bounds(branch):
+        """Rebuilds the state from scratch (for the root, and for nodes CPLEX
+        made without our state) from the variables fixed at 1 in this node"""
+        fixed = np.asarray(branch.get_lower_bounds())[branch.var_idx] > 0.5
+        agents, items = np.nonzero(fixed)
+        return NodeState(np.packbits(fixed.any(axis=0)), (branch.model.u * fixed).sum(axis=1), len(items),
+                         tuple((item, agent, True) for item, agent in zip(items, agents)))
+
+    def child(self, branch, bounds):
+        """State of the child node that changes the bounds in bounds, a list
+        of (column, "L"/"U"/"B", bound); only fixing x_{ij} of an item not
+        yet fixed, to 1 or to 0, changes anything"""
+
+        col_agent, col_item = _column_assignments(branch)
+        assigned, own, delta = self.assigned, self.own, []
+        for col, direction, bound in bounds:
+            if col >= len(col_agent) or col_agent[col] < 0:
+                continue
+            agent, item = col_agent[col], col_item[col]
+            if _bit(assigned, item):
+                continue
+
+            if direction != "U" and bound > 0.5:
+                if assigned is self.assigned:
+                    assigned, own = assigned.copy(), own.copy()
+                assigned[item >> 3] |= 128 >> (item & 7)
+                own[agent] += branch.model.u[agent,item]
+                delta.append((item, agent, True))
+            elif direction != "L" and bound < 0.5:
+                delta.append((item, agent, False))
+
+        if not delta:
+            return self
+        num_fixed = sum(1 for _, _, fixed in delta if fixed)
+        return NodeState(assigned, own, self.num_assigned + num_fixed, tuple(delta), self)
+
+    def _derive(self, branch):
+        # (owner, next_agent, V) for this node, from the nearest ancestor that
+        # has them (copied) or from scratch, updated by the deltas since
+        if self.derived is not None:
+            return self.derived
+
+        path = [self]
+        while path[-1].parent is not None and path[-1].parent.derived is None:
+            path.append(path[-1].parent)
+        base = path[-1].parent
+        if base is not None:
+            owner, next_agent, V = [a.copy() for a in base.derived]
+        else:
+            n, m = branch.model.n, branch.model.m
+            owner, next_agent, V = np.empty(m, dtype=int), np.zeros(m, dtype=int), np.zeros((n, n))
+            owner.fill(-1)
+
+        u = branch.model.u
+        _, agent_order = _item_orders(branch)
+        for state in reversed(path):
+            for item, agent, fixed in state.delta:
+                if fixed:
+                    owner[item] = agent
+                    V[:,agent] += u[:,item]
+                elif next_agent[item] < branch.model.n and agent_order[item, next_agent[item]] == agent:
+                    next_agent[item] += 1
+        self.derived = (owner, next_agent, V)
+
+        # The parent's copy is only needed until its last child has its own
+        if self.parent is not None and self.parent.derived is not None:
+            self.parent.pending_children -= 1
+            if self.parent.pending_children <= 0:
+                self.parent.derived = None
+        return self.derived
+
+    def owner(self, branch):
+        """The agent each item is fixed to in this subtree (-1 if none yet);
+        shared with the state, so not to be changed"""
+        return self._derive(branch)[0]
+
+    def next_agent(self, branch):
+        """How many agents, in each item's value order, our item-value
+        branching ruled out of getting it on this path (shared, like owner)"""
+        return self._derive(branch)[1]
+
+    def num_envious(self, branch):
+        """Agents who value some other bundle more than their own
+        (CPLEX's minimum constraint violation allowance is 1e-9)"""
+        V = self._derive(branch)[2].copy()
+        np.fill_diagonal(V, -np.inf)
+        return np.count_nonzero(V.max(axis=1) > self.own + 1e-9)
+
+
+def _bit(bits, k):
+    # Bit k of packed bits (np.packbits order)
+    return bits[k >> 3] & (128 >> (k & 7))
+
+
+def _column_assignments(branch):
+    """For each column, the agent and item of its x_{ij} (-1 for any other
+    variable), computed once per registered callback"""
+    if getattr(branch, 'col_agent', None) is None:
+        num_cols = branch.var_idx.max() + 1
+        branch.col_agent = np.empty(num_cols, dtype=int)
+        branch.col_agent.fill(-1)
+        branch.col_item = branch.col_agent.copy()
+        agents, items = np.indices(branch.var_idx.shape)
+        branch.col_agent[branch.var_idx] = agents
+        branch.col_item[branch.var_idx] = items
+    return branch.col_agent, branch.col_item
+
+
+def _item_orders(branch):
+    """Items by decreasing average value, and each item's agents by decreasing
+    value for it (ties broken by lower index), computed once per registered
+    callback"""
+    if getattr(branch, 'item_order', None) is None:
+        branch.item_order = np.argsort(-branch.model.m_avg_vals, kind='mergesort')
+        branch.agent_order = np.argsort(-branch.model.u.T, axis=1, kind='mergesort')
+    return branch.item_order, branch.agent_order
+
+
+def node_state(branch):
+    """This node's NodeState: from its node data if we created the node,
+    else rebuilt from its bounds"""
+    state = branch.get_node_data()
+    if state is None:
+        state = NodeState.from_bounds(branch)
+    return state
+
+
+def make_branches(branch, state, branches):
+    """Creates the child nodes, each a (node estimate, [(column, direction,
+    bound), ...]), handing each its updated NodeState"""
+    children = [state.child(branch, bounds) for _, bounds in branches]
+    state.pending_children = sum(1 for child in children if child is not state)
+    for (estimate, bounds), child in zip(branches, children):
+        branch.make_branch(estimate, variables = bounds, node_data = child)
+
+
+def cplex_branches(branch):
+    """The branches CPLEX was about to create at this node"""
+    return [branch.get_branch(k) for k in xrange(branch.get_num_branches())]
+
+
 class MyTooMuchEnvyBranch(BranchCallback):
 
     """ Fathoms the current path if the number of unallocated items is less than
     the number of remaining envious agents (always infeasible in this case)
     """
     def __call__(self):
-        if MyTooMuchEnvyBranch.should_fathom(self):
+        if self.get_branch_type() != self.branch_type.variable:
+            return
+        state = node_state(self)
+        if MyTooMuchEnvyBranch.should_fathom(self, state):
             self.times_used += 1
             self.prune()
+        else:
+            # Branch as CPLEX would have, but keep our state going
+            make_branches(self, state, cplex_branches(self))
 
 
     @staticmethod
-    def should_fathom(branch):
+    def should_fathom(branch, state = None):
         
         br_type = branch.get_branch_type()
         #if br_type == branch.branch_type.SOS1 or br_type == branch.branch_type.SOS2:
@@ -28,60 +200,22 @@ class MyTooMuchEnvyBranch(BranchCallback):
         if br_type != branch.branch_type.variable:
             return False
 
-        x = branch.get_values()
-        model = branch.model
+        if state is None:
+            state = node_state(branch)
 
-        # TBD: This is a heavyweight computation for now; look at CPLEX API
-        # to figure out how to count violated constraints, since we have one
-        # constraint per pairwise possible envy between two agents.
-        num_envious_agents = 0
-        
-        # For each allocation A_i to agent i, and each allocation A_j to agent j,
-        # make sure agent i values A_i at least as much as she values A_j
-        for a_i in xrange(model.n):
-            
-            a_i_envious = False
-
-            # Check A_i's valuation for her current allocation 
-            i_indices = [a_i*model.m + j for j in xrange(model.m)]
-            i_values = model.u[a_i]
-            a_i_allocation_val = 0
-            for item_idx, i_index in enumerate(i_indices):
-                a_i_allocation_val += (x[i_index]==1.0) * i_values[item_idx]
-
-
-            # Check if agent A_i is envious of any other agent A_j
-            for a_j in xrange(model.n):
-
-                # Agent i is not envious of her own allocation
-                if a_i == a_j:
-                    continue
-
-                # Calculate A_i's valuation for A_j's current bundle
-                a_j_allocation_val = 0
-                j_indices = [a_j*model.m + j for j in xrange(model.m)]
-                for item_idx, j_index in enumerate(j_indices):
-                    a_j_allocation_val += (x[j_index]==1.0) * i_values[item_idx]
-
-                # Does A_i value A_j's allocation more than her own?
-                # (CPLEX's minimum constraint violation allowance is 1e-9)
-                if (a_i_allocation_val + 1e-9) < a_j_allocation_val:
-                    a_i_envious = True
-                    break
-
-            # If this agent is envious, count it exactly once and move on
-            # to see if other agents are envious, too
-            if a_i_envious:
-                num_envious_agents += 1
-                continue
-        
-        # Unallocated items = M - \sum_{all binaries}
-        allocated_items = sum([1 for assgn in x if assgn == 1.0])
-        num_remaining_items = model.m - allocated_items
+        # Envious agents need at least one more item each; items are fixed
+        # to agents in the whole subtree, so bundle values only grow from here
+        # (the bundles come back from the fixings on this path, checked
+        # against each agent's own bundle value)
+        num_envious_agents = state.num_envious(branch)
+        num_remaining_items = branch.model.m - state.num_assigned
 
         fathom_subtree = (num_envious_agents > num_remaining_items)
-        if fathom_subtree:
-            print "Model.m={0}, sum(x)={1}, int(round(sum(x)))={2}, envy_ct={3}, firing={4}".format(model.m, sum(x), allocated_items, num_envious_agents, (num_envious_agents > num_remaining_items))
+
+        # Optionally tally the (#envious agents, #remaining items) we fathom at
+        fathom_stats = getattr(branch, 'fathom_stats', None)
+        if fathom_subtree and fathom_stats is not None:
+            fathom_stats[(num_envious_agents, num_remaining_items)] += 1
 
         # Don't explore this subtree if too few items to create E-F allocation
         # (Call neither prune() nor make_branch() --> CPLEX branches normally)
@@ -92,7 +226,7 @@ class MyBranchOnAvgItemValue(BranchCallback):
 
     """ Branches based on average item value (pick the item with the highest
     average value that isn't allocated, then branch on giving it to the agent
-    that currently wants it the most.
+    that currently wants it the most, of those not yet ruled out).
     """    
     def __call__(self):
         
@@ -100,67 +234,97 @@ class MyBranchOnAvgItemValue(BranchCallback):
         MyBranchOnAvgItemValue.choose_branch(self)
 
     @staticmethod
-    def choose_branch(branch):
+    def choose_branch(branch, state = None):
         
         br_type = branch.get_branch_type()
         if br_type == branch.branch_type.SOS1 or br_type == branch.branch_type.SOS2:
             return
 
         objval = branch.get_objective_value()
-        x = branch.get_values()
-
-        # Get the highest average value remaining unallocated item, and branch
-        # on giving that item to the agent who values it the most
-        # Todo: drop from O(nm) to something lower via priority queues (maybe not worth it)
-        #       or if we're SOS1ing items maybe check for inactive constraints
-        max_avg_item_val = -sys.maxint - 1
+        x = np.asarray(branch.get_values())
+        if state is None:
+            state = node_state(branch)
+        item_order, agent_order = _item_orders(branch)
+
+        # Go down the items by average value to the first one that is
+        # neither fixed in this subtree nor (partly) allocated in the LP,
+        # and branch on giving it to the agent who values it the most, of
+        # those we haven't already ruled out on this path
         branch_var = -1
-        for item_j in xrange(branch.model.m):
-            
-            # Figure out if item_j is allocated; if it's not allocated,
-            # determine which agent_i wants it the most
-            allocated = False
-            max_agent_val = -sys.maxint - 1
-            max_agent_cand = -1
-            for agent_i in xrange(branch.model.n):            
-                if int(round(x[agent_i * branch.model.n + item_j])) != 0:
-                    allocated = True
-                    break
-                elif branch.model.u[agent_i][item_j] > max_agent_val:
-                    max_agent_val = branch.model.u[agent_i][item_j]
-                    max_agent_cand = agent_i
-
-            # Branch candidate!  Is this the highest avg value unallocated item?
-            if not allocated:
-                if branch.model.m_avg_vals[item_j] > max_avg_item_val:
-                    branch_var = max_agent_cand*branch.model.m + item_j
-                    max_avg_item_val = branch.model.m_avg_vals[item_j]
-
+        owner, next_agent = state.owner(branch), state.next_agent(branch)
+        for item_j in item_order:
+            if owner[item_j] >= 0 or next_agent[item_j] >= branch.model.n \
+                    or (np.abs(x[branch.var_idx[:,item_j]]) >= 0.5).any():
+                continue
+            branch_var = int(branch.var_idx[agent_order[item_j, next_agent[item_j]], item_j])
+            break
 
         # Branching on binary, so we force a var=1 branch with lower bound "L"=1,
         # and we force a var=0 branch with upper bound "U"=0
         if branch_var >= 0:
-            branch.make_branch(objval, variables = [(branch_var, "L", 1)])
-            branch.make_branch(objval, variables = [(branch_var, "U", 0)])
+            make_branches(branch, state, [(objval, [(branch_var, "L", 1)]),
+                                          (objval, [(branch_var, "U", 0)])])
+        else:
+            make_branches(branch, state, cplex_branches(branch))
 
 
 class MyBranchSOS1Envy(BranchCallback):
-    """TBD
+    """ Branches on the envy of the most envious agent in the (rounded)
+    relaxation: of the fractional items partly in bundles she envies, take
+    the one most of her envy comes from, and split its SOS1 set (the agents
+    it can go to) into the agents she envies and the rest, giving it to one
+    side or the other.
     """
 
     def __call__(self):
-        self.times_used += 1
-        choose_branch(self)
+        if MyBranchSOS1Envy.choose_branch(self):
+            self.times_used += 1
 
     @staticmethod
-    def choose_branch(branch):
+    def choose_branch(branch, state = None):
+        """Makes the branches; returns whether they were ours, rather than
+        left to (or copied from) CPLEX"""
 
         br_type = branch.get_branch_type()
-        if br_type == branch.branch_type.SOS1 or br_type == branch.branch_type.SOS2:
-            return
+        if br_type == branch.branch_type.SOS2:
+            return False
 
-        # Do some stuff here someday...
-        return
+        objval = branch.get_objective_value()
+        X = np.asarray(branch.get_values())[branch.var_idx]
+        if state is None:
+            state = node_state(branch)
+        u = branch.model.u
+
+        # Most envious agent, once the relaxation's items are rounded to their
+        # biggest shares (the fractional bundles satisfy the envy rows)
+        rounded = np.zeros(X.shape)
+        rounded[np.argmax(X, axis=0), np.arange(X.shape[1])] = 1
+        V = u.dot(rounded.T)
+        agent_envy = V.max(axis=1) - V.diagonal()
+        envier = np.argmax(agent_envy)
+        envied = V[envier] > V[envier, envier] + 1e-9
+
+        # Items whose LP share goes to both sides of the split, scored by how
+        # much of the envier's envy they account for
+        support = X > 1e-6
+        splits = support[envied].any(axis=0) & support[~envied].any(axis=0)
+        if agent_envy[envier] <= 1e-9 or not splits.any():
+            # No envy, or none we can split on; branch as CPLEX would have
+            make_branches(branch, state, cplex_branches(branch))
+            return False
+        score = np.where(splits, u[envier] * X[envied].sum(axis=0), -np.inf)
+        item_j = np.argmax(score)
+
+        # Two children: item_j goes to an agent the envier doesn't envy, or
+        # to one she does; a side of one agent gets the item outright
+        branches = []
+        for side in (~envied, envied):
+            bounds = [(int(col), "U", 0) for col in branch.var_idx[~side, item_j]]
+            if np.count_nonzero(side) == 1:
+                bounds.append((int(branch.var_idx[side, item_j][0]), "L", 1))
+            branches.append((objval, bounds))
+        make_branches(branch, state, branches)
+        return True
 
 
 class MyTooMuchEnvyAndBranchOnAvgItemValue(BranchCallback):
@@ -172,14 +336,17 @@ class MyTooMuchEnvyAndBranchOnAvgItemValue(BranchCallback):
     def __call__(self):
 
         # Can we fathom this path?  If so, stop branching
-        if MyTooMuchEnvyBranch.should_fathom(self):
+        if self.get_branch_type() != self.branch_type.variable:
+            return
+        state = node_state(self)
+        if MyTooMuchEnvyBranch.should_fathom(self, state):
             self.times_too_much_envy_used += 1
             self.prune()
             return
 
         # We have to keep branching; use average item value
         self.times_branch_on_avg_item_used += 1
-        MyBranchOnAvgItemValue.choose_branch(self)
+        MyBranchOnAvgItemValue.choose_branch(self, state)
 
         return
 
@@ -193,19 +360,36 @@ class MyTooMuchEnvyAndBranchSOS1Envy(BranchCallback):
     def __call__(self):
 
         # Can we fathom this path?  If so, stop branching
-        if MyTooMuchEnvyBranch.should_fathom(self):
+        if self.get_branch_type() == self.branch_type.SOS2:
+            return
+        state = node_state(self)
+        if MyTooMuchEnvyBranch.should_fathom(self, state):
             self.times_too_much_envy_used += 1
             self.prune()
             return
 
-        # We have to keep branching; use average item value
-        self.times_sos1_envy_used += 1
-        MyBranchSOS1Envy.choose_branch(self)
+        # We have to keep branching; split on the most envious agent's envy
+        if MyBranchSOS1Envy.choose_branch(self, state):
+            self.times_sos1_envy_used += 1
 
         return
 
 
 
+class MyLazyEnvy(LazyConstraintCallback):
+    """ Adds the envy rows the formulation left out (lazy_envy) that a
+    candidate solution violates, as lazy constraints, remembering which
+    """
+    def __call__(self):
+
+        violated = self.form.violated_envy_rows(self.get_values())
+        for k in violated:
+            self.add(constraint = cplex.SparsePair(ind = self.form.lazy_cols[k].tolist(),
+                                                   val = self.form.lazy_vals[k].tolist()),
+                     sense = "G", rhs = 0.0)
+        self.rows_added.update(violated.tolist())
+
+
 class MyMIPInfo(MIPInfoCallback):
     """ Dummy class; this is the only way I could coerce CPLEX into returning
     the number of nodes in its B&C tree.
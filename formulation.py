@@ -0,0 +1,355 @@
+import numpy as np
+from model import ObjType
+import symmetry
+
+
+class Formulation:
+    """The envy-free IP as NumPy arrays: M item rows, then the envy rows, as
+    COO triplets sorted by row (indptr gives the CSR row pointers), ready to
+    be bulk-loaded into a solver.  Always look up x_{ij} through var_idx."""
+
+    def __init__(self, model, obj_type = ObjType.feasibility, with_envy_var = False, break_symmetry = False,
+                 aggregate_items = False, lazy_envy = False):
+
+        n, m = model.n, model.m
+        self.n = n
+        self.m = m
+        self.with_envy_var = with_envy_var
+
+        # Item types (just the items, unless aggregating), and their values:
+        # aggregating merges items every agent values the same into one type
+        # (item_type[j] is item j's, numbered by first item), with one integer
+        # x_{it} in [0, multiplicity[t]] per agent and type instead
+        self.aggregate_items = aggregate_items
+        if aggregate_items:
+            _, first, inverse, counts = np.unique(model.u.T, axis=0, return_index=True, return_inverse=True,
+                                                  return_counts=True)
+            order = np.argsort(first)
+            rank = np.empty(len(order), dtype=int)
+            rank[order] = np.arange(len(order))
+            self.item_type = rank[inverse.ravel()]
+            self.multiplicity = counts[order]
+            values = model.u[:,first[order]]
+        else:
+            self.item_type = np.arange(m)
+            self.multiplicity = np.ones(m, dtype=int)
+            values = model.u
+        m = values.shape[1]
+
+        # Column index of variable x_{ij} (x_{it} if aggregating), then maybe
+        # E, the max envy; extend() and symmetry breaking append more columns
+        self.var_idx = np.arange(n*m).reshape(n, m)
+        self.num_x = n*m
+        num_cols = self.num_x + (1 if with_envy_var else 0)
+        self.envy_var = self.num_x if with_envy_var else None
+
+        # Set objective function
+        self.obj = np.zeros(num_cols)
+        self.maximize = False
+        if with_envy_var:
+            # Objective: 0*[binary allocation variables] + 1*[envy variable]
+            self.obj[-1] = 1
+        elif obj_type == ObjType.social_welfare_max:
+            # Objective: max \sum_i \sum_j v_{ij} x_{ij}
+            self.maximize = True
+            self.obj[:self.num_x] = values.ravel()
+        elif obj_type != ObjType.feasibility:
+            # Objective: nothing [just feasibility] otherwise
+            raise ValueError("Could not determine objective function type for model.")
+
+        # One binary variable per item per agent (or integer, per item type),
+        # and possibly one continuous variable representing the maximum envy
+        # between pairs of agents
+        self.lb = np.zeros(num_cols)
+        self.ub = np.ones(num_cols)
+        self.ub[:self.num_x] = np.tile(self.multiplicity, n)
+        self.types = "I"*self.num_x
+        if with_envy_var:
+            self.ub[-1] = np.inf
+            self.types += "C"
+
+        # Each item can be allocated to exactly one agent [SOS1]
+        # For each item j, \sum_i x_{ij} = 1
+        item_rows = np.repeat(np.arange(m), n)
+        item_cols = self.var_idx.T.ravel()
+        item_vals = np.ones(n*m)
+
+        # For each allocation A_i to agent i, and each allocation A_j to agent j,
+        # make sure agent i values A_i at least as much as she values A_j:
+        # {my val, my bundle} - {my val, your bundle} (+ E) >= 0
+        a_i, a_j = np.nonzero(~np.eye(n, dtype=bool))
+        envy_cols = [self.var_idx[a_i], self.var_idx[a_j]]
+        envy_vals = [values[a_i], -values[a_i]]
+        if with_envy_var:
+            envy_cols.append(np.full((len(a_i), 1), self.num_x, dtype=int))
+            envy_vals.append(np.ones((len(a_i), 1)))
+        envy_cols = np.hstack(envy_cols)
+        envy_vals = np.hstack(envy_vals)
+        width = envy_cols.shape[1]
+
+        # Lazily, start with each agent's row against the agent whose tastes
+        # are closest to hers, the one she's likeliest to envy; the rest
+        # (lazy_pairs) wait for add_envy_rows() or a solver callback
+        self.lazy_envy = lazy_envy
+        if lazy_envy:
+            similarity = values.dot(values.T)
+            np.fill_diagonal(similarity, -np.inf)
+            seed = (a_j == np.argmax(similarity, axis=1)[a_i])
+            self.lazy_pairs = (a_i[~seed], a_j[~seed])
+            self.lazy_cols, self.lazy_vals = envy_cols[~seed], envy_vals[~seed]
+            self.lazy_added = np.zeros(len(self.lazy_pairs[0]), dtype=bool)
+            a_i, a_j, envy_cols, envy_vals = a_i[seed], a_j[seed], envy_cols[seed], envy_vals[seed]
+
+        self.envy_pairs = (a_i, a_j)
+        num_pairs = len(a_i)
+        self.envy_rows = m + np.arange(num_pairs)
+        envy_rows = np.repeat(m + np.arange(num_pairs), width)
+
+        self.rows = np.concatenate((item_rows, envy_rows))
+        self.cols = np.concatenate((item_cols, envy_cols.ravel()))
+        self.vals = np.concatenate((item_vals, envy_vals.ravel()))
+        self.indptr = np.concatenate((np.arange(m+1)*n, n*m + np.arange(1, num_pairs+1)*width))
+
+        self.senses = "E"*m + "G"*num_pairs
+        self.rhs = np.concatenate((self.multiplicity, np.zeros(num_pairs)))
+
+        # Symmetry-breaking rows after the envy rows, with a column s_{aj}
+        # (prefix_idx) per item and agent a with an identical later agent
+        self.break_symmetry = break_symmetry
+        if break_symmetry:
+            self.agent_pairs = symmetry.consecutive_pairs(symmetry.agent_groups(model))
+            self.prefix_agents = np.unique(self.agent_pairs[0])
+            self.prefix_idx = np.zeros((len(self.prefix_agents), 0), dtype=int)
+            self._add_prefix_columns(m)
+            (sym_rows, sym_cols, sym_vals), sym_senses = self._symmetry_rows(values, 0, len(self.rhs))
+            self.rows = np.concatenate((self.rows, sym_rows))
+            self.cols = np.concatenate((self.cols, sym_cols))
+            self.vals = np.concatenate((self.vals, sym_vals))
+            self.indptr = np.searchsorted(self.rows, np.arange(len(self.rhs) + len(sym_senses) + 1))
+            self.senses += sym_senses
+            self.rhs = np.concatenate((self.rhs, np.zeros(len(sym_senses))))
+
+    def _add_prefix_columns(self, k):
+        # Appends the s_{aj} columns of k more items (types)
+        new_idx = len(self.obj) + np.arange(len(self.prefix_agents)*k).reshape(-1, k)
+        self.prefix_idx = np.hstack((self.prefix_idx, new_idx))
+        self.obj = np.concatenate((self.obj, np.zeros(new_idx.size)))
+        self.lb = np.concatenate((self.lb, np.zeros(new_idx.size)))
+        self.ub = np.concatenate((self.ub, np.full(new_idx.size, np.inf)))
+        self.types += "C"*new_idx.size
+
+    def _symmetry_rows(self, values, first_item, row_start):
+        """Symmetry-breaking rows for the items (with values values) from
+        first_item on, numbered from row_start, as ((rows, cols, vals), their
+        senses); all have right-hand side 0:
+
+        * each s_{aj} counts a's items up to j: s_{aj} - s_{a,j-1} - x_{aj} = 0
+        * for identical agents a < b (neighbours in their group), b only gets
+          item j if a got an earlier item: x_{bj} - s_{a,j-1} <= 0 (for item
+          types t, if a got some of type t or earlier:
+          x_{bt} - multiplicity[t] s_{at} <= 0)
+        * for identical items j' < j (neighbours in their group), j goes to an
+          agent no earlier than j' does: \sum_i i x_{ij'} - \sum_i i x_{ij} <= 0
+          (item types are never identical)
+
+        Going through the running counts keeps the agent rows to two nonzeros
+        each, rather than one per earlier item.  Every allocation can be made
+        to satisfy them by swapping identical agents' bundles and identical
+        items (see start_values)."""
+
+        # Blocks of rows of equal width, as (cols, vals of each row, sense)
+        blocks = []
+        a = np.searchsorted(self.prefix_agents, self.agent_pairs[0])
+        b = self.agent_pairs[1]
+        for j in xrange(first_item, values.shape[1]):
+            s_j, x_j = self.prefix_idx[:,j], self.var_idx[self.prefix_agents,j]
+            if j > 0:
+                s_prev = self.prefix_idx[:,j-1]
+                blocks.append((np.column_stack((s_j, s_prev, x_j)), [1.0, -1.0, -1.0], "E"))
+            else:
+                blocks.append((np.column_stack((s_j, x_j)), [1.0, -1.0], "E"))
+
+            if self.aggregate_items:
+                blocks.append((np.column_stack((self.var_idx[b,j], self.prefix_idx[a,j])),
+                               [1.0, -float(self.multiplicity[j])], "L"))
+            elif j > 0:
+                blocks.append((np.column_stack((self.var_idx[b,j], self.prefix_idx[a,j-1])), [1.0, -1.0], "L"))
+            else:
+                blocks.append((self.var_idx[b,j][:,np.newaxis], [1.0], "L"))
+
+        # Pair each new item with the last earlier item identical to it
+        agents = np.arange(1, self.n)
+        for group in (symmetry.identical_groups(values.T) if self.n > 1 else []):
+            for prev_j, j in zip(group[:-1], group[1:]):
+                if j < first_item:
+                    continue
+                blocks.append((np.concatenate((self.var_idx[agents,prev_j], self.var_idx[agents,j]))[np.newaxis],
+                               np.concatenate((agents, -agents)).astype(float), "L"))
+
+        rows, cols, vals, senses = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)], [np.zeros(0)], ""
+        row = row_start
+        for block_cols, block_vals, sense in blocks:
+            num_rows, width = block_cols.shape
+            rows.append(np.repeat(row + np.arange(num_rows), width))
+            cols.append(block_cols.ravel())
+            vals.append(np.tile(block_vals, num_rows))
+            senses += sense*num_rows
+            row += num_rows
+        return (np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)), senses
+
+    def violated_envy_rows(self, values):
+        """Indices into lazy_pairs of the envy rows not yet added that the
+        column values violate"""
+        x = np.asarray(values)
+        violated = (self.lazy_vals * x[self.lazy_cols]).sum(axis=1) < -1e-6
+        return np.flatnonzero(violated & ~self.lazy_added)
+
+    def add_envy_rows(self, lazy):
+        """Appends the lazy envy rows with indices lazy (into lazy_pairs) to
+        the matrix; returns (first new row, (rows, cols, vals) of the new
+        nonzeros), for loading into a solver incrementally"""
+
+        lazy = np.asarray(lazy)
+        row_start = len(self.rhs)
+        width = self.lazy_cols.shape[1]
+        new_rows = np.repeat(row_start + np.arange(len(lazy)), width)
+        new_cols = self.lazy_cols[lazy].ravel()
+        new_vals = self.lazy_vals[lazy].ravel()
+        self.lazy_added[lazy] = True
+
+        self.rows = np.concatenate((self.rows, new_rows))
+        self.cols = np.concatenate((self.cols, new_cols))
+        self.vals = np.concatenate((self.vals, new_vals))
+        self.indptr = np.concatenate((self.indptr, self.indptr[-1] + np.arange(1, len(lazy)+1)*width))
+        self.senses += "G"*len(lazy)
+        self.rhs = np.concatenate((self.rhs, np.zeros(len(lazy))))
+
+        return row_start, (new_rows, new_cols, new_vals)
+
+    def num_envy_rows(self):
+        """Envy rows in the matrix (all n*(n-1), unless lazy)"""
+        return len(self.envy_pairs[0]) + (np.count_nonzero(self.lazy_added) if self.lazy_envy else 0)
+
+    def can_extend(self, model):
+        """Whether extend(model) is possible: not with item types or lazy
+        envy rows, and our agent symmetry breaking needs the identical agents
+        to stay identical on the new items"""
+        if self.aggregate_items or self.lazy_envy:
+            return False
+        if not self.break_symmetry:
+            return True
+        a, b = self.agent_pairs
+        return np.array_equal(model.u[a,self.m:], model.u[b,self.m:])
+
+    def start_values(self, model, owner):
+        """Values of the var_idx columns (flattened) for giving each item j to
+        agent owner[j], or for the equivalent allocation our symmetry
+        breaking allows"""
+
+        # Items in order of type, so that identical agents can be put in
+        # order of their first item type
+        by_type = np.argsort(self.item_type, kind='mergesort')
+        owner = np.asarray(owner)[by_type]
+        if self.break_symmetry:
+            owner = symmetry.canonical_allocation(owner, symmetry.agent_groups(model),
+                                                  [] if self.aggregate_items else symmetry.item_groups(model))
+        counts = np.zeros(self.var_idx.shape)
+        np.add.at(counts, (owner, self.item_type[by_type]), 1)
+        return counts.ravel()
+
+    def prefix_values(self, values):
+        """(columns, values) of the s_{aj} columns (see _symmetry_rows) that
+        go with the values of the var_idx columns (flattened), e.g. from
+        start_values"""
+        counts = np.asarray(values).reshape(self.var_idx.shape)
+        return self.prefix_idx.ravel(), np.cumsum(counts[self.prefix_agents], axis=1).ravel()
+
+    def allocation(self, values):
+        """The agent receiving each item, from the values of the var_idx
+        columns (flattened); a type's items go out in item order.  Solvers
+        only return integers within their tolerances, so rather than rounding
+        counts, each of a type's items in turn goes to the agent with the most
+        of the type still unaccounted for."""
+        left = np.array(values, dtype=float).reshape(self.var_idx.shape)
+        types, agents = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)]
+        for k in xrange(self.multiplicity.max() if self.m > 0 else 0):
+            active = np.flatnonzero(self.multiplicity > k)
+            best = np.argmax(left[:,active], axis=0)
+            left[best, active] -= 1
+            types.append(active)
+            agents.append(best)
+        types, agents = np.concatenate(types), np.concatenate(agents)
+
+        owner = np.empty(self.m, dtype=int)
+        owner[np.argsort(self.item_type, kind='mergesort')] = agents[np.lexsort((agents, types))]
+        return owner
+
+    def item_sos1_sets(self, col_start = 0):
+        """Each item's x_{ij} (from column col_start on) as an SOS1 set, as
+        (columns, weights): at most one agent gets the item.  The item rows
+        already say exactly one; the sets just let a solver branch on them."""
+        weights = np.arange(1, self.n+1)
+        return [(self.var_idx[:,j], weights) for j in np.flatnonzero(self.var_idx[0] >= col_start)]
+
+    def extend(self, model):
+        """Adds the items of model beyond the first self.m (which model must
+        share with the model this was built from; see can_extend).  New
+        columns (x_{ij}, then any s_{aj}) and item rows are appended, and the
+        existing envy rows pick up the new items.  Returns (first new column,
+        first new row, (rows, cols, vals) of the new nonzeros), for loading
+        into a solver incrementally."""
+
+        n, old_m, k = self.n, self.m, model.m - self.m
+        col_start, row_start = len(self.obj), len(self.rhs)
+        self.item_type = np.arange(model.m)
+        self.multiplicity = np.ones(model.m, dtype=int)
+
+        # One new binary variable per new item per agent
+        new_idx = col_start + np.arange(n*k).reshape(n, k)
+        self.var_idx = np.hstack((self.var_idx, new_idx))
+        self.num_x += n*k
+        new_obj = model.u[:,old_m:].ravel() if (self.maximize and not self.with_envy_var) else np.zeros(n*k)
+        self.obj = np.concatenate((self.obj, new_obj))
+        self.lb = np.concatenate((self.lb, np.zeros(n*k)))
+        self.ub = np.concatenate((self.ub, np.ones(n*k)))
+        self.types += "I"*(n*k)
+        if self.break_symmetry:
+            self._add_prefix_columns(k)
+
+        # Each new item can be allocated to exactly one agent
+        item_rows = row_start + np.repeat(np.arange(k), n)
+        item_cols = new_idx.T.ravel()
+        item_vals = np.ones(n*k)
+
+        # Every agent values the new items in its own and in others' bundles
+        a_i, a_j = self.envy_pairs
+        envy_rows = np.repeat(self.envy_rows, 2*k)
+        envy_cols = np.hstack((new_idx[a_i], new_idx[a_j])).ravel()
+        envy_vals = np.hstack((model.u[a_i,old_m:], -model.u[a_i,old_m:])).ravel()
+
+        new_rows = np.concatenate((item_rows, envy_rows))
+        new_cols = np.concatenate((item_cols, envy_cols))
+        new_vals = np.concatenate((item_vals, envy_vals))
+
+        self.senses += "E"*k
+        self.rhs = np.concatenate((self.rhs, np.ones(k)))
+
+        # Break the symmetries among the new items, too
+        if self.break_symmetry:
+            (sym_rows, sym_cols, sym_vals), sym_senses = self._symmetry_rows(model.u, old_m, len(self.rhs))
+            new_rows = np.concatenate((new_rows, sym_rows))
+            new_cols = np.concatenate((new_cols, sym_cols))
+            new_vals = np.concatenate((new_vals, sym_vals))
+            self.senses += sym_senses
+            self.rhs = np.concatenate((self.rhs, np.zeros(len(sym_senses))))
+        self.m = model.m
+
+        # Keep the full matrix sorted by row, with its CSR row pointers
+        rows = np.concatenate((self.rows, new_rows))
+        order = np.argsort(rows, kind='mergesort')
+        self.rows = rows[order]
+        self.cols = np.concatenate((self.cols, new_cols))[order]
+        self.vals = np.concatenate((self.vals, new_vals))[order]
+        self.indptr = np.searchsorted(self.rows, np.arange(len(self.rhs)+1))
+
+        return col_start, row_start, (new_rows, new_cols, new_vals)
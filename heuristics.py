@@ -0,0 +1,186 @@
+import numpy as np
+import time
+from model import ObjType
+
+# Slack for comparing bundle values (utilities are scaled to [0,1000])
+EPS = 1e-6
+
+
+def bundle_values(model, owner):
+    """V[i,k] is agent i's value for agent k's bundle, where item j goes to
+    agent owner[j]"""
+    assignment = np.zeros((model.n, model.m))
+    assignment[owner, np.arange(model.m)] = 1
+    return model.u.dot(assignment.T)
+
+
+def envy(V):
+    """How much each agent envies her most envied bundle (0 if not envious)"""
+    return np.maximum(V.max(axis=1) - V.diagonal(), 0)
+
+
+def is_envy_free(model, owner):
+    return np.all(envy(bundle_values(model, owner)) <= EPS)
+
+
+def max_value_allocation(model):
+    """Gives each item to the agent who values it most"""
+    return np.argmax(model.u, axis=0)
+
+
+def round_robin_allocation(model, agent_order):
+    """Agents take turns, in agent_order, picking their favourite item left"""
+
+    owner = np.empty(model.m, dtype=int)
+    u = model.u.copy()
+    for pick in xrange(model.m):
+        agent = agent_order[pick % len(agent_order)]
+        item = np.argmax(u[agent])
+        owner[item] = agent
+        u[:,item] = -np.inf
+    return owner
+
+
+def envy_cycle_allocation(model):
+    """Lipton et al.'s envy-cycle elimination: hands out items by decreasing
+    average value, each to an unenvied agent, first rotating bundles along an
+    envy cycle whenever every agent is envied"""
+
+    n = model.n
+    owner = np.empty(model.m, dtype=int)
+    allocated = np.zeros(model.m, dtype=bool)
+    V = np.zeros((n, n))
+
+    for item in np.argsort(-model.m_avg_vals, kind='mergesort'):
+
+        envies = V > V.diagonal()[:,np.newaxis] + EPS    # envies[i,k]: i envies k
+        while envies.any(axis=0).all():
+            # Every agent is envied, so walking from any agent to one of her
+            # enviers must revisit an agent; rotate bundles along that cycle
+            path = [0]
+            while np.argmax(envies[:,path[-1]]) not in path:
+                path.append(np.argmax(envies[:,path[-1]]))
+            cycle = path[path.index(np.argmax(envies[:,path[-1]])):]
+
+            # Each agent on the cycle takes the bundle of the agent she envies
+            new_owner = np.arange(n)
+            for envied, envier in zip(cycle, cycle[1:] + cycle[:1]):
+                new_owner[envied] = envier
+            owner[allocated] = new_owner[owner[allocated]]
+            V[:,new_owner] = V.copy()
+            envies = V > V.diagonal()[:,np.newaxis] + EPS
+
+        # Give the item to whichever unenvied agent wants it most
+        unenvied = np.flatnonzero(~envies.any(axis=0))
+        agent = unenvied[np.argmax(model.u[unenvied,item])]
+        owner[item] = agent
+        allocated[item] = True
+        V[:,agent] += model.u[:,item]
+
+    return owner
+
+
+def local_search(model, owner, max_iters = None):
+    """Repairs an allocation by repeatedly letting the most envious agent take
+    an item from (or swap an item with) the bundle she envies most, as long as
+    that lowers the total envy; returns the improved allocation"""
+
+    owner = owner.copy()
+    V = bundle_values(model, owner)
+    total_envy = envy(V).sum()
+    if max_iters is None:
+        max_iters = 10*model.m
+
+    for _ in xrange(max_iters):
+        if total_envy <= EPS:
+            break
+
+        agent_envy = V.max(axis=1) - V.diagonal()
+        i = np.argmax(agent_envy)
+        k = np.argmax(V[i])
+        items_i = np.flatnonzero(owner == i)
+        items_k = np.flatnonzero(owner == k)
+
+        # Candidate changes in bundle value: move one of k's items to i,
+        # or swap one of k's items with one of i's
+        moves = [(j, None) for j in items_k] + [(j, l) for j in items_k for l in items_i]
+        to_i = np.array([model.u[:,j] - (0 if l is None else model.u[:,l]) for j, l in moves])
+        V_new = np.repeat(V[np.newaxis], len(moves), axis=0)
+        V_new[:,:,i] += to_i
+        V_new[:,:,k] -= to_i
+        new_envy = np.maximum(V_new.max(axis=2) - np.diagonal(V_new, axis1=1, axis2=2), 0).sum(axis=1)
+
+        best = np.argmin(new_envy)
+        if new_envy[best] >= total_envy - EPS:
+            break
+        j, l = moves[best]
+        owner[j] = i
+        if l is not None:
+            owner[l] = k
+        V = V_new[best]
+        total_envy = new_envy[best]
+
+    return owner
+
+
+def _constructions(model):
+    """Our cheap constructions, cheapest first, each as a function to call"""
+    return [
+        lambda: max_value_allocation(model),
+        lambda: round_robin_allocation(model, np.arange(model.n)),
+        lambda: round_robin_allocation(model, np.argsort(model.n_max_vals)),
+        lambda: envy_cycle_allocation(model),
+        ]
+
+
+def welfare(model, owner):
+    """Total value of the allocation to the agents who get the items"""
+    return model.u[owner, np.arange(model.m)].sum()
+
+
+def max_envy(model, owner):
+    """The alternate IP's objective for the allocation: the most any agent
+    envies any bundle (0 if envy-free)"""
+    return envy(bundle_values(model, owner)).max()
+
+
+def best_start(model, allocations, obj_type, alternate_IP_model):
+    """Which of allocations to hand the IP as its incumbent: the least envious
+    one for the alternate (min-envy) model, where any allocation is feasible;
+    otherwise an envy-free one, the one with the most welfare if maximizing
+    welfare, or failing that the least envious, for the solver to repair"""
+
+    envies = [max_envy(model, owner) for owner in allocations]
+    if not alternate_IP_model:
+        envy_free = [owner for owner, e in zip(allocations, envies) if e <= EPS]
+        if envy_free and obj_type == ObjType.social_welfare_max:
+            return max(envy_free, key=lambda owner: welfare(model, owner))
+        if envy_free:
+            return envy_free[0]
+    return allocations[int(np.argmin(envies))]
+
+
+def find_allocation(model):
+    """Tries our cheap constructions, each repaired by local search, until one
+    is envy-free.  Returns (allocation, whether it is envy-free, candidates,
+    runtime), where the allocation is the least envious one found, as the
+    agent receiving each item, and candidates are all the allocations tried,
+    as constructed and as repaired, for seeding an IP solve (see best_start)."""
+
+    start = time.time()
+
+    best_owner, best_envy = None, np.inf
+    candidates = []
+    for construct in _constructions(model):
+        constructed = construct()
+        owner = local_search(model, constructed)
+        candidates.extend((constructed, owner))
+        total_envy = envy(bundle_values(model, owner)).sum()
+        if total_envy < best_envy:
+            best_owner, best_envy = owner, total_envy
+        if is_envy_free(model, owner):
+            break
+
+    stop = time.time()
+
+    return (best_owner, is_envy_free(model, best_owner), candidates, stop-start)
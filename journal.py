@@ -0,0 +1,43 @@
+import os
+
+
+class Journal:
+    """Append-only record of the parts of tasks (each repeat of a grid cell)
+    a run has finished, so a killed run can resume where it stopped.  Each
+    line holds a part's key and the size of the csv output once its rows were
+    safely on disk; each line goes out in a single O_APPEND write followed by
+    an fsync, so a kill leaves at most one torn last line, which reading
+    ignores.  On resume, the output is cut back to the last recorded size,
+    dropping rows of any half-written part."""
+
+    def __init__(self, filename, resume = False):
+        self.filename = filename
+        self.done = set()
+        self.csv_size = 0
+
+        if resume and os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                for line in f:
+                    fields = line.split()
+                    if not line.endswith("\n") or len(fields) != 2 or not fields[1].isdigit():
+                        continue
+                    self.done.add(fields[0])
+                    self.csv_size = max(self.csv_size, int(fields[1]))
+
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        if not resume:
+            flags |= os.O_TRUNC
+        self.fd = os.open(filename, flags, 0644)
+
+    def is_done(self, key):
+        return key in self.done
+
+    def record(self, key, csv_size):
+        """Marks the part done, once the output holds csv_size bytes"""
+        os.write(self.fd, "{0} {1}\n".format(key, csv_size))
+        os.fsync(self.fd)
+        self.done.add(key)
+        self.csv_size = csv_size
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""Manifests list a sweep's tasks, one grid cell of one configuration each,
+so a big experiment can be split into disjoint shards (driver.py --manifest
+FILE --shard i/k) and the shards' output merged back together (this script).
+
+A manifest is a csv file with one row per task:
+
+    task_id, seed, #agents, #items (space-separated), #output rows, config
+
+where config is the JSON of the driver options the task runs with.  The
+driver appends each task's id to every output row it writes for it.
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+
+def append(filename, tasks):
+    """Appends tasks (seed, num_agents, items_list, num_rows, config) to the
+    manifest, numbering them after any tasks already there; returns their ids"""
+
+    first_id = len(read(filename)) if os.path.exists(filename) else 0
+    with open(filename, 'ab') as f:
+        writer = csv.writer(f, delimiter=',')
+        for task_id, (seed, num_agents, items_list, num_rows, config) in enumerate(tasks, first_id):
+            writer.writerow([task_id, seed, num_agents, " ".join(str(m) for m in items_list), num_rows, config])
+    return range(first_id, first_id + len(tasks))
+
+
+def read(filename):
+    """Returns the manifest's tasks as (task_id, seed, num_agents, items_list,
+    num_rows, config)"""
+
+    tasks = []
+    with open(filename, 'rb') as f:
+        for task_id, seed, num_agents, items, num_rows, config in csv.reader(f, delimiter=','):
+            tasks.append((int(task_id), long(seed), int(num_agents), [int(m) for m in items.split()],
+                          int(num_rows), config))
+    return tasks
+
+
+def parse_shard(s):
+    """Parses "i/k", for the i-th of k shards (0 <= i < k)"""
+    try:
+        i, k = [int(x) for x in s.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must look like i/k, not {0}".format(s))
+    if not 0 <= i < k:
+        raise argparse.ArgumentTypeError("shard i/k needs 0 <= i < k, not {0}".format(s))
+    return (i, k)
+
+
+def shard(tasks, i, k):
+    """The i-th of k disjoint slices of tasks; dealing them out round-robin
+    mixes easy and hard grid cells evenly across shards"""
+    return tasks[i::k]
+
+
+def merge(tasks, filenames, out_filename):
+    """Writes one complete copy of each task's rows, from any of the output
+    files, to out_filename (in task order).  A copy is all the rows with the
+    task's id in one file (workers write tasks' repeats interleaved, and a
+    resumed run finishes a task after others), and counts only if it has
+    exactly the rows the manifest expects; tasks cut short by killed jobs
+    never do.  Returns (ids of tasks with no complete copy, number of extra
+    complete copies dropped, number of incomplete copies dropped)."""
+
+    expected = dict((task[0], task[4]) for task in tasks)
+    found = {}
+    num_duplicates = num_incomplete = 0
+
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            copies, order = {}, []
+            for row in csv.reader(f, delimiter=','):
+                try:
+                    task_id = int(row[-1])
+                except (ValueError, IndexError):
+                    task_id = None
+                if task_id not in copies:
+                    copies[task_id] = []
+                    order.append(task_id)
+                copies[task_id].append(row)
+
+        for task_id, rows in ((task_id, copies[task_id]) for task_id in order):
+            if task_id not in expected or len(rows) != expected[task_id] \
+                    or len(set(len(row) for row in rows)) != 1:
+                num_incomplete += 1
+            elif task_id in found:
+                num_duplicates += 1
+            else:
+                found[task_id] = rows
+
+    with open(out_filename, 'wb') as f:
+        writer = csv.writer(f, delimiter=',')
+        for task_id in sorted(found):
+            writer.writerows(found[task_id])
+
+    missing = sorted(set(expected) - set(found))
+    return missing, num_duplicates, num_incomplete
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Merges the output of a sharded manifest run.')
+    parser.add_argument("manifest", metavar="MANIFEST", help="manifest the outputs were run from")
+    parser.add_argument("outputs", metavar="CSV", nargs="+", help="driver output files, in any order")
+    parser.add_argument("-o", "--output", dest="output", required=True,
+                        metavar="FILE", help="write the merged comma-delimited csv to FILE")
+    args = parser.parse_args()
+
+    tasks = read(args.manifest)
+    missing, num_duplicates, num_incomplete = merge(tasks, args.outputs, args.output)
+
+    print "Merged {0} of {1} tasks; dropped {2} duplicate and {3} incomplete copies.".format(
+        len(tasks) - len(missing), len(tasks), num_duplicates, num_incomplete)
+    if missing:
+        print "Missing tasks: {0}".format(" ".join(str(task_id) for task_id in missing))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,4 @@
-import random        # for uniform random
-import copy          # for urn sampling
-import numpy as np   # for Zipf sampling
+import numpy as np   # for utility storage and batch sampling
 
 class DupValues:
     allowed, disallowed, disallowed_max = range(3)
@@ -14,91 +12,181 @@ class ObjType:
 class Model:
     """Stores utility functions for each of N agents for M items"""
 
-    def __init__(self, utilities, num_items, dist_type, dup_values):
-        # raw utilities
-        self.n = len(utilities)
-        self.u = utilities
-        self.m = num_items
-        
+    def __init__(self, utilities, num_items, dist_type, dup_values, profile_ids = None):
+        # raw utilities, held as one contiguous (n, m) array
         # For experiments, move from [0,1] prefs to [0,1000] prefs
         # (CPLEX's minimum constraint violation is 1e-9, too small)
-        for agent_u in self.u:
-            for item_j in xrange(len(agent_u)):
-                agent_u[item_j] *= 1000
-
-        # Precompute statistics for branching heuristics
-        self.m_avg_vals = [None]*self.m
-        for j in xrange(self.m):
-            item_avg = 0
-            for u_list in self.u:
-                item_avg += u_list[j]
-            self.m_avg_vals[j] = item_avg / self.m
+        self.u = np.array(utilities, dtype=np.float64) * 1000
+        self.n = self.u.shape[0]
+        self.m = num_items
+
+        # Precompute statistics for branching heuristics and bounds
+        self.m_avg_vals = self.u.mean(axis=0)   # average value of each item
+        self.n_max_vals = self.u.max(axis=1)    # top item value of each agent
 
         # properties/settings
         self.dist_type = dist_type
         self.dup_values = dup_values
         self.obj_type = ObjType.feasibility
 
+        # Agents with the same profile id (if the generator tracked them)
+        # have identical utilities
+        self.profile_ids = profile_ids
+
 
     @staticmethod
-    def __legal_wrt_duplicates(u, dup_values):
+    def __legal_wrt_duplicates(U, dup_values):
+        """Boolean mask over the rows of U (one row per agent) that satisfy
+        the duplicate valuation allowance"""
         if dup_values == DupValues.allowed:
             # No rules on duplication; done
-            return True
-        elif dup_values == DupValues.disallowed:
+            return np.ones(U.shape[0], dtype=bool)
+
+        ascending = np.sort(U, axis=1)
+        if dup_values == DupValues.disallowed:
             # No duplicate valuations AT ALL; set is all unique elements
-            if len(u) == len(set(u)):
-                return True
+            return np.all(ascending[:,1:] != ascending[:,:-1], axis=1)
         else:
             # Only need to make sure top and second-to-top elements
             # have different valuations
-            descending = sorted(u, reverse=True)
-            if len(descending) > 1 and descending[0] != descending[1]:
-                return True
+            if U.shape[1] < 2:
+                return np.zeros(U.shape[0], dtype=bool)
+            return ascending[:,-1] != ascending[:,-2]
+
+    @staticmethod
+    def __sample_legal(sample_rows, num_instances, num_agents, num_items, dup_values):
+        """Draws an (R, n, m) batch by calling sample_rows(k, m) for k agent
+        rows at a time, re-drawing only the rows that break dup_values"""
 
-        return False
+        U = sample_rows(num_instances*num_agents, num_items)
+        redraw = ~Model.__legal_wrt_duplicates(U, dup_values)
+        while redraw.any():
+            U[redraw] = sample_rows(np.count_nonzero(redraw), num_items)
+            redraw[redraw] = ~Model.__legal_wrt_duplicates(U[redraw], dup_values)
+
+        return U.reshape(num_instances, num_agents, num_items)
 
     @staticmethod
-    def generate_urand_int(num_agents, num_items, dup_values = DupValues.allowed):
-        """Generates a random set of ints that sum to 10*num_items
-        as utilities for num_agents agents"""
+    def sample_urand_int(num_instances, num_agents, num_items, dup_values = DupValues.allowed):
+        """Batch of random ints that sum to 10*num_items per agent, as an
+        (R, n, m) array"""
 
         # Each agent is given a budget of max_pts valuation points
         max_pts = 10*num_items
 
-        # Generate random utility functions for each agent
-        utilities = []
-        for _ in xrange(num_agents):
+        def sample_rows(k, m):
+            # Sample m-1 cut points in [0, max_pts]; the gaps between sorted
+            # cuts (with 0 and max_pts as endpoints) sum to max_pts
+            cuts = np.random.randint(0, max_pts+1, size=(k, m-1))
+            cuts = np.sort(np.hstack((np.zeros((k,1), dtype=cuts.dtype),
+                                      cuts,
+                                      np.full((k,1), max_pts, dtype=cuts.dtype))), axis=1)
+            u = np.diff(cuts, axis=1).astype(np.float64)
+
+            # Randomly distribute the sampled values to items
+            shuffle = np.argsort(np.random.random((k, m)), axis=1)
+            return u[np.arange(k)[:,np.newaxis], shuffle]
+
+        return Model.__sample_legal(sample_rows, num_instances, num_agents, num_items, dup_values)
+
+    @staticmethod
+    def sample_urand_real(num_instances, num_agents, num_items, dup_values = DupValues.allowed):
+        """Batch of u.a.r. reals in [0,1] (variable sum), as an (R, n, m) array"""
+
+        sample_rows = lambda k, m: np.random.random((k, m))
+        return Model.__sample_legal(sample_rows, num_instances, num_agents, num_items, dup_values)
+
+    @staticmethod
+    def sample_zipf_real(num_instances, num_agents, num_items, alpha, dup_values = DupValues.allowed):
+        """Batch of valuations drawn from Zipf with parameter alpha, as an
+        (R, n, m) array"""
 
-            while(True):
-            
-                # Sample some integer values
-                u = [0]
-                for _ in xrange(num_items-1):
-                    u.append( random.randint(0,max_pts) )
-                u.append(max_pts)
+        sample_rows = lambda k, m: np.random.zipf(alpha, (k, m)).astype(np.float64)
+        return Model.__sample_legal(sample_rows, num_instances, num_agents, num_items, dup_values)
 
-                # Make sampled integer values sum to max_pts
-                u = sorted(u)
-                for idx, val in enumerate(u):
-                    if idx==0:
-                        continue
-                    else:
-                        u[idx-1] = u[idx]-u[idx-1]
-                del u[-1]
+    @staticmethod
+    def sample_polya_urn_real(num_instances, num_agents, num_items, param_r, param_a, add_noise = False,
+                              return_profiles = False):
+        """Batch of Polya-Eggenberger urn profiles (see generate_polya_urn_real),
+        as an (R, n, m) array; with return_profiles, also returns the (R, n)
+        ids of the profile each agent drew, numbered within each instance in
+        order of first appearance"""
+
+        if add_noise:
+            # Noisy balls are all distinct, so draw each instance's urn in turn
+            draws = [Model.__polya_urn(num_agents, num_items, param_a, add_noise)
+                     for _ in xrange(num_instances)]
+            U = np.array([u for u, _ in draws]).reshape(num_instances, num_agents, num_items)
+            P = np.array([ids for _, ids in draws]).reshape(num_instances, num_agents)
+            return (U, P) if return_profiles else U
+
+        # Without noise, the urn before agent i holds the "random" ball plus
+        # param_a copies of each earlier agent's profile, so drawing a ball is
+        # the same as copying an earlier agent chosen u.a.r.
+        U = np.zeros((num_instances, num_agents, num_items))
+        P = np.zeros((num_instances, num_agents), dtype=int)
+        num_profiles = np.zeros(num_instances, dtype=int)
+        instances = np.arange(num_instances)
+        for i in xrange(num_agents):
+            fresh = np.random.random(num_instances) * (1 + param_a*i) < 1
+            source = np.random.randint(0, max(i,1), size=num_instances)
+            U[:,i] = np.where(fresh[:,np.newaxis],
+                              np.random.random((num_instances, num_items)),
+                              U[instances, source])
+            P[:,i] = np.where(fresh, num_profiles, P[instances, source])
+            num_profiles += fresh
+        return (U, P) if return_profiles else U
 
-                # Randomly distribute the sampled values to items
-                random.shuffle(u)
+    @staticmethod
+    def sample_correlated_real(num_instances, num_agents, num_items):
+        """Batch of correlated profiles (see generate_correlated_real), as an
+        (R, n, m) array"""
 
-                # Make sure utilities align with duplicate valuation allowance
-                if Model.__legal_wrt_duplicates(u, dup_values):
-                    break
+        # Sample means for the normal values of each item
+        # means in [0.4, 0.6], stdevs from 0.2 (for u=0.4) to 0.3 (for u=0.6)
+        min_mean = 0.4
+        max_mean = 0.6
+        min_stdev = 0.2
+        max_stdev = 0.3
+        base_means = min_mean + (max_mean-min_mean)*np.random.random((num_instances, 1, num_items))
+        base_stdevs = min_stdev + (max_stdev-min_stdev)*( 1.0-((max_mean-base_means)/(max_mean-min_mean)) )
 
-            # Legal utility vector for agent created; record and continue
-            utilities.append(u)
-            
+        # Sample from each item's intrinsic normal, truncating utilities to [0,1]
+        U = np.random.normal(base_means, base_stdevs, (num_instances, num_agents, num_items))
+        return np.clip(U, 0, 1)
 
+    @staticmethod
+    def generate_batch(num_instances, num_agents, num_items, dist_type, dup_values = DupValues.allowed,
+                       zipf_alpha = 2., urn_r = 2, urn_a = 1, return_profiles = False):
+        """Draws num_instances raw utility profiles from dist_type in one call;
+        returns an (R, n, m) array, each slice of which can be handed to Model.
+        With return_profiles, also returns the (R, n) profile ids of agents
+        for distributions that track them (None for the rest)"""
+
+        if dist_type == DistTypes.polya_urn_real:
+            return Model.sample_polya_urn_real(num_instances, num_agents, num_items, urn_r, urn_a,
+                                               return_profiles = return_profiles)
+        elif return_profiles:
+            U = Model.generate_batch(num_instances, num_agents, num_items, dist_type, dup_values, zipf_alpha)
+            return U, None
+
+        if dist_type == DistTypes.urand_int:
+            return Model.sample_urand_int(num_instances, num_agents, num_items, dup_values)
+        elif dist_type == DistTypes.urand_real:
+            return Model.sample_urand_real(num_instances, num_agents, num_items, dup_values)
+        elif dist_type == DistTypes.zipf_real:
+            return Model.sample_zipf_real(num_instances, num_agents, num_items, zipf_alpha, dup_values)
+        elif dist_type == DistTypes.correlated_real:
+            return Model.sample_correlated_real(num_instances, num_agents, num_items)
+        else:
+            raise Exception("Distribution type {0} is not recognized.".format(dist_type))
 
+    @staticmethod
+    def generate_urand_int(num_agents, num_items, dup_values = DupValues.allowed):
+        """Generates a random set of ints that sum to 10*num_items
+        as utilities for num_agents agents"""
+
+        utilities = Model.sample_urand_int(1, num_agents, num_items, dup_values)[0]
         return Model(utilities, num_items, DistTypes.urand_int, dup_values)
         
 
@@ -107,19 +195,7 @@ class Model:
         """Generates a random set of reals (variable sum) as utilities
         for num_agents agents"""
 
-        # Generate random utility functions for each agent
-        utilities = []
-        for _ in xrange(num_agents):
-            
-            while(True):
-                # Sample some real [0,1] values
-                u = [random.random() for _ in xrange(num_items)]
-
-                if Model.__legal_wrt_duplicates(u, dup_values):
-                    break
-
-            utilities.append(u)
-             
+        utilities = Model.sample_urand_real(1, num_agents, num_items, dup_values)[0]
         return Model(utilities, num_items, DistTypes.urand_real, dup_values)
         
 
@@ -128,18 +204,7 @@ class Model:
         """Pulls real-valued utilities from a Zipf distribution with 
         parameter alpha for each of the num_agents agents"""
         
-        utilities = []
-
-        for _ in xrange(num_agents):
-        
-            while(True):
-                # Draws num_items valuations from Zipf with parameter alpha
-                u = np.random.zipf(alpha, num_items).tolist()   # Need list, not np.array for CPLEX
-                if Model.__legal_wrt_duplicates(u, dup_values):
-                    break
-
-            utilities.append(u)
-
+        utilities = Model.sample_zipf_real(1, num_agents, num_items, alpha, dup_values)[0]
         return Model(utilities, num_items, DistTypes.zipf_real, dup_values)
 
 
@@ -150,44 +215,65 @@ class Model:
         param_r: number of "RANDOM" balls in urn at start
         param_a: number of repeat balls to add to urn at each sample"""
 
+        utilities, profile_ids = Model.__polya_urn(num_agents, num_items, param_a, add_noise)
+        return Model(utilities, num_items, DistTypes.polya_urn_real, True, profile_ids)
+
+
+    @staticmethod
+    def __polya_urn(num_agents, num_items, param_a, add_noise):
+        """Draws one instance's (n, m) profiles from the urn, along with the
+        id of the profile each agent received (numbered in order of first
+        appearance, as profiles are only made when an agent draws them)"""
+
         # (1)  start with an urn containing a single ball called "Random".
         # (2)  For each agent, draw a ball:
         # (3.i)   If that ball is "Random": the agent's utility profile u_i is chosen u.a.r. and add the "Random" ball back into the urn along with A copies of u_i
         # (3.ii)  Else: the agent's utility profile is the ball and replace that ball and A copies of the ball.
         # We can still use the problem size-independent parameterization used by Walsh (which looks to be taken from a 2006 paper in "Group Decision and Negotiation").
 
-        # Initially, the urn contains the single distinguished "random" ball
-        random_ball = "RANDOM"
-        urn = [random_ball]
+        # The urn is a table of ball groups with a ball count per group.  Group
+        # 0 is the distinguished "random" ball; every other group holds copies
+        # of one profile.  With noise, a group's balls are distinct noisy
+        # copies, and a copy's noise is only sampled once that ball is drawn.
+        profiles = []           # distinct utility profiles, by profile id
+        group_profile = [None]  # profile id each group's balls are copies of
+        counts = [1]            # number of balls in each group
+        noisy_balls = {}        # (group, ball) -> profile id of a drawn noisy ball
 
-        # Store chosen utility profiles for each of the agents
-        utilities = []
-        for _ in xrange(num_agents):
+        # Store chosen utility profile ids for each of the agents
+        profile_ids = np.empty(num_agents, dtype=int)
+        for agent in xrange(num_agents):
 
-            ball = random.choice(urn)
-            if ball == random_ball:
-                # if the ball is random, choose a random utility profile
-                u = [random.random() for _ in xrange(num_items)]
+            # Weighted draw of a ball, by its group's ball count
+            cum_counts = np.cumsum(counts)
+            group = np.searchsorted(cum_counts, np.random.random()*cum_counts[-1], side='right')
 
-            else:
+            if group == 0:
+                # if the ball is random, choose a random utility profile
+                profiles.append(np.random.random(num_items))
+                profile_id = len(profiles)-1
+            elif not add_noise:
                 # otherwise, the ball is our agent's utility profile
-                u = copy.deepcopy(ball)
-            utilities.append(u)
+                profile_id = group_profile[group]
+            else:
+                # or one particular noisy copy of the group's profile
+                ball = (group, np.random.randint(counts[group]))
+                if ball not in noisy_balls:
+                    # Add u=0, stdev=noise to u, then cap utilities to min 0 and max 1
+                    noisy_u = profiles[group_profile[group]] + np.random.normal(0, 0.01, num_items)
+                    profiles.append(np.clip(noisy_u, 0, 1))
+                    noisy_balls[ball] = len(profiles)-1
+                profile_id = noisy_balls[ball]
+            profile_ids[agent] = profile_id
 
             # Add param_a new copies of u to the urn (possibly with some noise)
-            numpy_u = np.array(u)
-            for _ in xrange(param_a):
-                
-                if add_noise:
-                    # Add u=0, stdev=noise to u, then cap utilities to min 0 and max 1
-                    noisy_u = numpy_u + np.random.normal(0, 0.01, num_items)
-                    noisy_u[noisy_u < 0] = 0
-                    noisy_u[noisy_u > 1] = 1
-                    urn.append( noisy_u.tolist() )
-                else:
-                    urn.append( numpy_u.tolist() )
-            
-        return Model(utilities, num_items, DistTypes.polya_urn_real, True)
+            if group == 0 or add_noise:
+                group_profile.append(profile_id)
+                counts.append(param_a)
+            else:
+                counts[group] += param_a
+
+        return np.array(profiles)[profile_ids], profile_ids
 
 
     @staticmethod
@@ -196,33 +282,5 @@ class Model:
         samples a value per item per agent from some normal around that
         base value for the item, with variance propto value of item"""
 
-        # Sample means for the normal values of each item
-        # means in [0.4, 0.6], stdevs from 0.2 (for u=0.4) to 0.3 (for u=0.6)
-        min_mean = 0.4
-        max_mean = 0.6
-        min_stdev = 0.2
-        max_stdev = 0.3
-        base_means = []
-        base_stdevs = []
-        for _ in xrange(num_items):
-            mu = min_mean + (max_mean-min_mean)*random.random()
-            sigma = min_stdev + (max_stdev-min_stdev)*( 1.0-((max_mean-mu)/(max_mean-min_mean)) ) 
-            base_means.append(mu)
-            base_stdevs.append(sigma)
-        base_means=np.array(base_means)
-        base_stdevs=np.array(base_stdevs)
-        
-
-        # Store chosen utility profiles for each of the agents
-        utilities = []
-        for _ in xrange(num_agents):
-
-            # Sample from each item's intrinsic normal, truncating utilities to [0,1]
-            u = np.random.normal(base_means, base_stdevs)
-            u[u < 0] = 0
-            u[u > 1] = 1
-            
-            utilities.append(u.tolist())
-
+        utilities = Model.sample_correlated_real(1, num_agents, num_items)[0]
         return Model(utilities, num_items, DistTypes.correlated_real, True)
-
@@ -0,0 +1,16 @@
+import numpy as np
+import os
+import tempfile
+
+
+def save_npz(filename, arrays, compressed = False):
+    """Writes arrays (a dict from name to array) to the .npz file filename.
+    Writes to a temporary file in the same directory and renames it into
+    place, so concurrent readers never see half a file"""
+    fd, temp_filename = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(os.path.abspath(filename)))
+    with os.fdopen(fd, 'wb') as f:
+        if compressed:
+            np.savez_compressed(f, **arrays)
+        else:
+            np.savez(f, **arrays)
+    os.rename(temp_filename, filename)
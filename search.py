@@ -0,0 +1,191 @@
+import numpy as np
+import time
+import bounds
+import symmetry
+from backends import no_branching_stats, SolveStatus
+
+# Slack for comparing bundle values built up by repeated += and -=
+EPS = 1e-6
+
+# Check the clock every this many nodes
+CLOCK_CHECK_NODES = 1024
+
+
+class BranchAndBound:
+    """Depth-first search over item-to-agent assignments for an envy-free
+    allocation.  Items are assigned in order of decreasing average value, each
+    first to the agents who value it most.  The search keeps the n x n bundle
+    value matrix V (V[i,k] is agent i's value for agent k's bundle) up to date
+    as items are assigned and taken back, and fathoms a node when either
+
+    * more agents are envious than there are items left to hand out (an
+      envious agent needs at least one more item; see MyTooMuchEnvyBranch),
+      tested only with fathom_too_much_envy, which counts the nodes it
+      fathoms in times_too_much_envy, or
+    * the agents short of envy-freeness or proportionality need more of the
+      remaining items between them than there are, even if each got her
+      favourites (other bundles never lose value as the search goes deeper).
+      Envious agents are short, so this fathoms every node the first does.
+
+    With break_symmetry, it skips all but one of the equivalent assignments
+    that permuting identical agents or items gives, as Formulation does, but
+    in the search's own item order: an agent only gets an item after the
+    identical agent before her has one, and an item identical to an earlier
+    one only goes to the same or a later agent.
+    """
+
+    def __init__(self, model, break_symmetry = False, fathom_too_much_envy = False):
+        self.model = model
+        self.fathom_too_much_envy = fathom_too_much_envy
+        self.n = model.n
+        self.m = model.m
+
+        # Search order over items, and each item's agents by decreasing value
+        self.order = np.argsort(-model.m_avg_vals, kind='mergesort')
+        self.u = model.u[:,self.order]
+        self.agent_order = np.argsort(-self.u.T, axis=1, kind='mergesort')
+
+        # The identical agent before each agent, and the depth of the
+        # identical item before each item in order (-1 for none)
+        self.prev_agent = np.empty(self.n, dtype=int)
+        self.prev_agent.fill(-1)
+        self.prev_item = np.empty(self.m, dtype=int)
+        self.prev_item.fill(-1)
+        if break_symmetry:
+            earlier, later = symmetry.consecutive_pairs(symmetry.agent_groups(model))
+            self.prev_agent[later] = earlier
+            depth_of = np.argsort(self.order)
+            for group in symmetry.item_groups(model):
+                depths = np.sort(depth_of[group])
+                self.prev_item[depths[1:]] = depths[:-1]
+
+        # remaining_vals[d,i] is agent i's value for items d, d+1, ... in order
+        self.remaining_vals = np.vstack((np.cumsum(self.u[:,::-1], axis=1)[:,::-1].T,
+                                         np.zeros((1, self.n))))
+        self.proportional_vals = self.remaining_vals[0] / self.n
+
+        self.num_nodes = 0
+        self.times_too_much_envy = 0
+        self.allocation = None
+        self.limit_reached = None
+
+    def __fathom(self, depth, V):
+        own_vals = V.diagonal()
+        best_vals = V.max(axis=1)
+        num_remaining = self.m - depth
+
+        # Don't explore this subtree if too few items to create E-F allocation
+        if self.fathom_too_much_envy and np.count_nonzero(best_vals > own_vals + EPS) > num_remaining:
+            self.times_too_much_envy += 1
+            return True
+
+        # More generally, in an E-F allocation each agent values her bundle at
+        # least as much as every other bundle (which only grow from here) and
+        # so at least 1/n of her total; count how many of the remaining items
+        # each agent needs, at best, to get there
+        deficits = np.maximum(best_vals, self.proportional_vals) - own_vals
+        needy = np.flatnonzero(deficits > EPS)
+        if len(needy) == 0:
+            return False
+        if len(needy) > num_remaining or np.any(self.remaining_vals[depth,needy] + EPS < deficits[needy]):
+            return True
+        best_remaining = np.cumsum(-np.sort(-self.u[needy,depth:], axis=1), axis=1)
+        items_needed = np.count_nonzero(best_remaining + EPS < deficits[needy,np.newaxis]) + len(needy)
+        return items_needed > num_remaining
+
+    def solve(self, time_limit = None, node_limit = None):
+        """Returns True iff an envy-free allocation exists; if so, stores it
+        in self.allocation (the agent receiving each item).  Gives up, setting
+        self.limit_reached and returning False, after time_limit seconds or
+        node_limit nodes (either may be None, for no limit)."""
+
+        start = time.time()
+        n, m = self.n, self.m
+        V = np.zeros((n, n))
+        owner = np.zeros(m, dtype=int)       # agent holding the d-th item in order
+        held = np.zeros(n, dtype=int)        # number of items each agent holds
+        tried = np.zeros(m+1, dtype=int)     # children already tried at each depth
+
+        depth = 0
+        entering = True
+        while depth >= 0:
+
+            if entering:
+                self.num_nodes += 1
+
+                # Out of budget?
+                if node_limit is not None and self.num_nodes > node_limit:
+                    self.limit_reached = SolveStatus.node_limit
+                    return False
+                if time_limit is not None and self.num_nodes % CLOCK_CHECK_NODES == 0 \
+                        and time.time() - start >= time_limit:
+                    self.limit_reached = SolveStatus.timeout
+                    return False
+                if self.__fathom(depth, V):
+                    tried[depth] = n
+                elif depth == m:
+                    # Every item is allocated and nobody is envious
+                    self.allocation = np.empty(m, dtype=int)
+                    self.allocation[self.order] = owner
+                    return True
+                else:
+                    tried[depth] = 0
+
+            if depth < m and tried[depth] < n:
+                # Branch: give the depth-th item to the next agent in line
+                agent = self.agent_order[depth, tried[depth]]
+                tried[depth] += 1
+                prev_agent, prev_item = self.prev_agent[agent], self.prev_item[depth]
+                if (prev_agent >= 0 and held[prev_agent] == 0) \
+                        or (prev_item >= 0 and agent < owner[prev_item]):
+                    # Symmetric to an assignment we try (or tried) instead
+                    entering = False
+                    continue
+                V[:,agent] += self.u[:,depth]
+                owner[depth] = agent
+                held[agent] += 1
+                depth += 1
+                entering = True
+            else:
+                # Subtree exhausted; take back the item that led here
+                depth -= 1
+                if depth >= 0:
+                    V[:,owner[depth]] -= self.u[:,depth]
+                    held[owner[depth]] -= 1
+                entering = False
+
+        return False
+
+
+def allocate(model, prefs):
+    """Decides envy-free existence by native branch and bound, reporting the
+    same statistics as allocator.allocate"""
+
+    # Record any runtime, build statistics from solving the model
+    stats = no_branching_stats()
+
+    start = time.time()
+    search = BranchAndBound(model, prefs.break_symmetry, prefs.branch_fathom_too_much_envy)
+    stop = time.time()
+    stats['ModelBuildTime'] = stop-start
+
+    start = time.time()
+    is_possibly_feasible, _ = bounds.max_contested_feasible(model)
+    feasible = is_possibly_feasible and search.solve(prefs.time_limit, prefs.node_limit)
+    stop = time.time()
+    stats['ModelSolveTime'] = stop-start
+
+    stats['MIPNodeCount'] = search.num_nodes
+    stats['MyTooMuchEnvyBranch'] = search.times_too_much_envy
+    stats['MIPObjVal'] = 0
+    stats['ModelFeasible'] = feasible
+    stats['EnvyRows'] = 0
+    if search.limit_reached is not None:
+        stats['SolveStatus'] = search.limit_reached
+    else:
+        stats['SolveStatus'] = SolveStatus.feasible if feasible else SolveStatus.infeasible
+
+    if feasible and prefs.verbose:
+        print "Envy-free allocation: {0}".format(search.allocation.tolist())
+
+    return stats
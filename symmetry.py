@@ -0,0 +1,62 @@
+import numpy as np
+
+
+def identical_groups(rows):
+    """Indices of identical rows, as a list of increasing index arrays, one
+    per group of two or more"""
+    if len(rows) == 0:
+        return []
+    _, inverse = np.unique(rows, axis=0, return_inverse=True)
+    return [group for group in (np.flatnonzero(inverse == k) for k in np.unique(inverse)) if len(group) > 1]
+
+
+def agent_groups(model):
+    """Agents with identical utilities: those drawn with the same profile id,
+    if the generator tracked them (a noisy copy gets its own), else those
+    whose values agree; ordered by first agent"""
+    if model.profile_ids is not None:
+        groups = identical_groups(np.asarray(model.profile_ids)[:,np.newaxis])
+    else:
+        groups = identical_groups(model.u)
+    return sorted(groups, key=lambda group: group[0])
+
+
+def item_groups(model):
+    """Items every agent values the same"""
+    return identical_groups(model.u.T)
+
+
+def consecutive_pairs(groups):
+    """(earlier, later) for each pair of neighbours within each group"""
+    pairs = [(group[k-1], group[k]) for group in groups for k in xrange(1, len(group))]
+    return (np.array([a for a, b in pairs], dtype=int), np.array([b for a, b in pairs], dtype=int))
+
+
+def canonical_allocation(owner, agent_groups, item_groups):
+    """The allocation equivalent to owner (giving item j to agent owner[j])
+    under swapping identical agents' bundles and identical items' owners that
+    satisfies our symmetry breaking: within each group of identical agents,
+    earlier agents get their first item earlier, or else get nothing; within
+    each group of identical items, earlier items go to earlier agents.  Both
+    steps only ever make the owner vector lexicographically smaller, so
+    alternating them ends."""
+
+    owner = np.array(owner)
+    m = len(owner)
+    while True:
+        changed = False
+        for group in item_groups:
+            owners = np.sort(owner[group])
+            if np.any(owners != owner[group]):
+                owner[group] = owners
+                changed = True
+        for group in agent_groups:
+            first = [np.flatnonzero(owner == agent) for agent in group]
+            first = [f[0] if len(f) > 0 else m for f in first]
+            relabel = np.arange(max(owner.max() if m > 0 else 0, group[-1]) + 1)
+            relabel[group[np.argsort(first, kind='mergesort')]] = group
+            if np.any(relabel[owner] != owner):
+                owner = relabel[owner]
+                changed = True
+        if not changed:
+            return owner
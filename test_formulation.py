@@ -0,0 +1,102 @@
+import unittest
+import numpy as np
+
+from model import Model, DistTypes, DupValues
+from formulation import Formulation
+
+
+def model_of(utilities):
+    return Model(np.array(utilities, dtype=float), len(utilities[0]), DistTypes.urand_real, DupValues.allowed)
+
+
+class AllocationTest(unittest.TestCase):
+    """Formulation.allocation decodes solver values into an owner per item"""
+
+    def test_round_trip(self):
+        np.random.seed(0)
+        m = model_of(np.random.random((4, 9)))
+        form = Formulation(m)
+        owner = np.random.randint(0, 4, size=9)
+        np.testing.assert_array_equal(form.allocation(form.start_values(m, owner)), owner)
+
+    def test_fractional_values(self):
+        # Items 0-2 are identical, so aggregate into one type of multiplicity 3
+        m = model_of([[.5, .5, .5, .1, .9],
+                      [.5, .5, .5, .8, .2]])
+        form = Formulation(m, aggregate_items = True)
+        self.assertEqual(form.multiplicity.tolist(), [3, 1, 1])
+
+        # Agent 0 gets two of the type and item 4, agent 1 one and item 3,
+        # with the values off integers the way CBC returns them after a start
+        counts = np.zeros(form.var_idx.shape)
+        counts[0, form.item_type[[0, 4]]] = [1.9999997, 0.9999996]
+        counts[1, form.item_type[[0, 3]]] = [1.0000004, 1.0000001]
+        counts[0, form.item_type[3]] = 3e-7
+
+        owner = form.allocation(counts.ravel())
+        np.testing.assert_array_equal(owner, [0, 0, 1, 1, 0])
+
+    def test_half_shares(self):
+        # Even a relaxation-like split gives every item exactly one owner:
+        # rounding gave these none, ties go to the first agent
+        m = model_of([[.3, .6], [.3, .6], [.2, .1]])
+        form = Formulation(m)
+        owner = form.allocation(np.full(form.var_idx.size, 0.5))
+        np.testing.assert_array_equal(owner, [0, 0])
+
+    def test_split_type(self):
+        # Rounding gave this type of 3 items 4 owners; instead agent 0, then
+        # 1, then 0 again has the most of it left
+        m = model_of([[.5, .5, .5], [.5, .5, .5]])
+        form = Formulation(m, aggregate_items = True)
+        self.assertEqual(form.multiplicity.tolist(), [3])
+        owner = form.allocation(np.array([1.5, 1.5]))
+        np.testing.assert_array_equal(owner, [0, 0, 1])
+
+
+class SymmetryTest(unittest.TestCase):
+    """The symmetry-breaking rows keep the canonical allocations"""
+
+    def slack(self, form, x):
+        # Row activities minus right-hand sides, just for the symmetry rows
+        ax = np.bincount(form.rows, weights=form.vals * x[form.cols], minlength=len(form.rhs))
+        first = form.envy_rows[-1] + 1
+        return np.array(list(form.senses[first:])), (ax - form.rhs)[first:]
+
+    def test_canonical_start(self):
+        np.random.seed(1)
+        for aggregate_items in (False, True):
+            profiles = np.random.random((2, 3))
+            m = model_of(profiles[[0, 1, 0, 0]][:,[0, 1, 2, 0, 1, 2, 2]])
+            form = Formulation(m, break_symmetry = True, aggregate_items = aggregate_items)
+
+            # One s_{aj} per item (type) for each of agents 0 and 2
+            self.assertEqual(form.prefix_idx.shape, (2, form.var_idx.shape[1]))
+            senses, slack = self.slack(form, self.values(form, m, [3, 3, 1, 0, 2, 0, 1]))
+            self.assertTrue(np.all(np.abs(slack[senses == "E"]) < 1e-9))
+            self.assertTrue(np.all(slack[senses == "L"] <= 1e-9))
+
+    def test_cuts_permuted_agents(self):
+        # Agents 0 and 1 are identical, so 1 can't get the first item alone
+        m = model_of([[.2, .7], [.2, .7], [.5, .1]])
+        form = Formulation(m, break_symmetry = True)
+        senses, slack = self.slack(form, self.values(form, m, [1, 2], canonical = False))
+        self.assertTrue(np.any(slack[senses == "L"] > 0))
+
+    def values(self, form, m, owner, canonical = True):
+        # All column values for the allocation (or its canonical form)
+        x = np.zeros(len(form.obj))
+        if canonical:
+            counts = form.start_values(m, owner)
+        else:
+            counts = np.zeros(form.var_idx.shape)
+            counts[owner, np.arange(len(owner))] = 1
+            counts = counts.ravel()
+        x[form.var_idx.ravel()] = counts
+        prefix_cols, prefix_vals = form.prefix_values(counts)
+        x[prefix_cols] = prefix_vals
+        return x
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+
+from model import Model, DistTypes, DupValues
+import symmetry
+
+
+class PolyaUrnTest(unittest.TestCase):
+    """The urn's profile ids say which agents share a profile"""
+
+    def groups_by_value(self, m):
+        return symmetry.agent_groups(Model(m.u / 1000., m.m, m.dist_type, m.dup_values))
+
+    def assertGroupsEqual(self, groups, other):
+        self.assertEqual([g.tolist() for g in groups], [g.tolist() for g in other])
+
+    def test_batch_ids(self):
+        np.random.seed(0)
+        U, P = Model.sample_polya_urn_real(50, 8, 5, 2, 1, return_profiles = True)
+        for u, ids in zip(U, P):
+            m = Model(u, 5, DistTypes.polya_urn_real, DupValues.allowed, ids)
+            self.assertGroupsEqual(symmetry.agent_groups(m), self.groups_by_value(m))
+
+            # Numbered by first appearance: each new id is one more than any before
+            self.assertEqual(ids[0], 0)
+            self.assertTrue(all(ids[i] <= ids[:i].max() + 1 for i in xrange(1, len(ids))))
+
+    def test_same_draws(self):
+        # Tracking the ids doesn't change what's drawn
+        np.random.seed(2)
+        U = Model.sample_polya_urn_real(10, 6, 4, 2, 1)
+        np.random.seed(2)
+        U_tracked, _ = Model.sample_polya_urn_real(10, 6, 4, 2, 1, return_profiles = True)
+        np.testing.assert_array_equal(U, U_tracked)
+
+    def test_single_instance_ids(self):
+        np.random.seed(1)
+        for add_noise in (False, True):
+            for _ in xrange(20):
+                m = Model.generate_polya_urn_real(8, 5, 2, 1, add_noise)
+                self.assertGroupsEqual(symmetry.agent_groups(m), self.groups_by_value(m))
+                ids = m.profile_ids
+                self.assertEqual(ids[0], 0)
+                self.assertTrue(all(ids[i] <= ids[:i].max() + 1 for i in xrange(1, len(ids))))
+
+
+if __name__ == '__main__':
+    unittest.main()
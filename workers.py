@@ -0,0 +1,86 @@
+import multiprocessing
+import select
+import traceback
+
+
+def _work(func, args, conn):
+    """Worker loop: runs func(args, task) on each task sent down conn, until
+    a None sentinel, sending back ('part', part) for each part it yields,
+    then ('done', None), or ('error', traceback)"""
+
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        try:
+            for part in func(args, task):
+                conn.send(('part', part))
+            conn.send(('done', None))
+        except BaseException:
+            # Includes the sys.exit() on solver errors
+            conn.send(('error', traceback.format_exc()))
+
+
+def _start_worker(func, args):
+    parent_conn, child_conn = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=_work, args=(func, args, child_conn))
+    p.daemon = True
+    p.start()
+    # Only the worker holds its end now, so its death reads as EOF here
+    child_conn.close()
+    return p, parent_conn
+
+
+def run_tasks(func, args, tasks, num_workers):
+    """Runs func(args, task), a generator of the task's results in parts, for
+    every task on num_workers processes, yielding (task, part, error) as each
+    part comes back; error is None, or the traceback of a failed task (with
+    part None), which yields nothing more.  A worker that dies outright, e.g.
+    in a solver segfault, only loses the rest of its current task, which is
+    reported as failed, and a fresh worker takes its place."""
+
+    idle = [_start_worker(func, args) for _ in xrange(min(num_workers, len(tasks)))]
+    busy = {}             # connection -> (worker process, index of its task)
+    next_task = 0
+
+    try:
+        while busy or next_task < len(tasks):
+
+            # Keep every worker busy while there's work left
+            while idle and next_task < len(tasks):
+                p, conn = idle.pop()
+                conn.send(tasks[next_task])
+                busy[conn] = (p, next_task)
+                next_task += 1
+
+            ready, _, _ = select.select(busy.keys(), [], [])
+            for conn in ready:
+                p, task_idx = busy.pop(conn)
+                try:
+                    kind, payload = conn.recv()
+                except (EOFError, IOError):
+                    # The worker died mid-task; replace it
+                    p.join()
+                    conn.close()
+                    idle.append(_start_worker(func, args))
+                    yield (tasks[task_idx], None, "Worker {0} died with exit code {1}".format(p.pid, p.exitcode))
+                    continue
+
+                if kind == 'part':
+                    busy[conn] = (p, task_idx)
+                    yield (tasks[task_idx], payload, None)
+                    continue
+
+                idle.append((p, conn))
+                if kind == 'error':
+                    yield (tasks[task_idx], None, payload)
+
+        # All done; let the workers exit
+        for p, conn in idle:
+            conn.send(None)
+            p.join()
+
+    finally:
+        for p, conn in idle + busy.values():
+            if p.is_alive():
+                p.terminate()